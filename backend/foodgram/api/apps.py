@@ -3,3 +3,55 @@ from django.apps import AppConfig
 
 class ApiConfig(AppConfig):
     name = 'api'
+
+    def ready(self):
+        from django.db.models.signals import (m2m_changed, post_delete,
+                                              post_save, pre_save)
+
+        from api.cache import (invalidate_author, invalidate_catalogue,
+                               invalidate_recipe, invalidate_recipe_tags,
+                               recipe_deleted, recipe_saved,
+                               remember_author_changes)
+        from recipes.models import Ingredient, Recipe, Tag
+        from users.models import User
+
+        post_save.connect(
+            recipe_saved, sender=Recipe,
+            dispatch_uid='Recipe_count_save'
+        )
+        post_delete.connect(
+            recipe_deleted, sender=Recipe,
+            dispatch_uid='Recipe_count_delete'
+        )
+
+        # Сброс кэша справочников, ответов анонимам (api/mixins.py)
+        # и фрагментов рецептов (api/serializers.py)
+        for model in (Ingredient, Tag):
+            post_save.connect(
+                invalidate_catalogue, sender=model,
+                dispatch_uid=f'{model.__name__}_responses_save'
+            )
+            post_delete.connect(
+                invalidate_catalogue, sender=model,
+                dispatch_uid=f'{model.__name__}_responses_delete'
+            )
+        post_save.connect(
+            invalidate_recipe, sender=Recipe,
+            dispatch_uid='Recipe_responses_save'
+        )
+        post_delete.connect(
+            invalidate_recipe, sender=Recipe,
+            dispatch_uid='Recipe_responses_delete'
+        )
+        m2m_changed.connect(
+            invalidate_recipe_tags, sender=Recipe.tags.through,
+            dispatch_uid='Recipe_tags_responses'
+        )
+        pre_save.connect(
+            remember_author_changes, sender=User,
+            dispatch_uid='User_responses_changes'
+        )
+        post_save.connect(
+            invalidate_author, sender=User,
+            dispatch_uid='User_responses_save'
+        )
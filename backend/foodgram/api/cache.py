@@ -0,0 +1,363 @@
+import hashlib
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, urlencode
+
+from recipes.models import Recipe
+
+CATALOGUE_VERSION_KEY = 'catalogue_version'
+RECIPES_VERSION_KEY = 'recipes_version'
+TRENDING_KEY = 'trending_recipe_ids'
+FRAGMENTS_VERSION_KEY = 'recipe_fragments_version'
+AUTHOR_VERSION_KEY = 'author_version:{}'
+
+# Поля автора, которые входят в ответ с рецептом
+AUTHOR_FIELDS = ('email', 'username', 'first_name', 'last_name')
+
+# Алиасы CACHES: версии и прочее состояние, которое нельзя вытеснять,
+# и фрагменты рецептов, которые вытеснять можно
+STATE_CACHE = 'state'
+FRAGMENTS_CACHE = 'fragments'
+
+# Тэги закэшированных ответов и ключи их версий в кэше состояния
+CATALOGUE_TAG = 'catalogue'
+RECIPES_TAG = 'recipes'
+RESPONSE_TAGS = {
+    CATALOGUE_TAG: CATALOGUE_VERSION_KEY,
+    RECIPES_TAG: 'recipes_content_version',
+}
+
+
+def content_etag(content):
+    """
+    ETag ответа — md5 его байтов. Один способ и для справочников,
+    и для кэша ответов: иначе клиент с токеном и без получал бы на
+    одинаковый ответ разные ETag
+    """
+    return '"{}"'.format(hashlib.md5(content).hexdigest())
+
+
+def state_cache():
+    return caches[STATE_CACHE]
+
+
+def get_version(key):
+    """
+    Версии хранятся в общем для воркеров кэше состояния, поэтому все
+    видят одно и то же значение. Смена версии делает устаревшими все
+    ключи с ней
+    """
+    version = state_cache().get(key)
+    if version is None:
+        state_cache().add(key, uuid.uuid4().hex, timeout=None)
+        version = state_cache().get(key)
+    return version
+
+
+def get_versions(keys):
+    """Версии нескольких ключей одним обращением к кэшу"""
+    versions = state_cache().get_many(keys)
+    for key in keys:
+        if key not in versions:
+            versions[key] = get_version(key)
+    return versions
+
+
+def bump_version(key):
+    state_cache().set(key, uuid.uuid4().hex, timeout=None)
+
+
+def get_catalogue_version():
+    """Версия справочников (ингредиенты и тэги)"""
+    return get_version(CATALOGUE_VERSION_KEY)
+
+
+def bump_catalogue_version():
+    """
+    Для изменений справочников мимо сигналов (bulk-загрузка).
+    Версия меняется после коммита, см. invalidate_tags
+    """
+    invalidate_tags(CATALOGUE_TAG)
+
+
+def bump_recipes_version():
+    """Версия числа рецептов; меняется после коммита, как и тэги ответов"""
+    transaction.on_commit(lambda: bump_version(RECIPES_VERSION_KEY))
+
+
+def recipe_saved(created, **kwargs):
+    """Обработчик post_save для Recipe: число меняется только при создании"""
+    if created:
+        bump_recipes_version()
+
+
+def recipe_deleted(**kwargs):
+    """Обработчик post_delete для Recipe"""
+    bump_recipes_version()
+
+
+def refresh_trending_ids():
+    """Пересчитывает топ популярных рецептов и кладёт id в кэш"""
+    ids = list(Recipe.objects.filter(popularity__gt=0).popular().values_list(
+        'pk', flat=True
+    )[:settings.TRENDING_SIZE])
+    state_cache().set(TRENDING_KEY, ids, settings.TRENDING_CACHE_TIMEOUT)
+    return ids
+
+
+def get_trending_ids():
+    ids = state_cache().get(TRENDING_KEY)
+    if ids is None:
+        ids = refresh_trending_ids()
+    return ids
+
+
+class CatalogueEntry:
+    def __init__(self, content):
+        self.content = content
+        self.etag = content_etag(content)
+
+
+class CatalogueCache:
+    """
+    Кэш справочников в памяти воркера. При смене версии в общем кэше
+    все записи сбрасываются и строятся заново при первом обращении
+    """
+    def __init__(self):
+        self._version = None
+        self._entries = {}
+
+    def get(self, key, builder):
+        version = get_catalogue_version()
+        if version != self._version:
+            self._entries = {}
+            self._version = version
+
+        if key not in self._entries:
+            self._entries[key] = builder()
+        return self._entries[key]
+
+    def get_rendered(self, key, builder):
+        """builder возвращает готовые байты ответа"""
+        return self.get(
+            key, lambda: CatalogueEntry(builder())
+        )
+
+
+catalogue_cache = CatalogueCache()
+
+
+def invalidate_tags(*tags):
+    """
+    Сбрасывает закэшированные ответы с этими тэгами. Версии меняются
+    после коммита, иначе параллельный запрос успел бы закэшировать
+    старые данные под новой версией
+    """
+    def bump():
+        for tag in tags:
+            bump_version(RESPONSE_TAGS[tag])
+    transaction.on_commit(bump)
+
+
+def forget_recipe_fragments(recipe_ids=None):
+    """
+    Сбрасывает фрагменты рецептов. recipe_ids — список id или подзапрос:
+    ревизия рецептов растёт в той же транзакции, что и изменение, так
+    что старый фрагмент не найдёт ни один воркер. Без recipe_ids —
+    все сразу, сменой версии после коммита
+    """
+    if recipe_ids is None:
+        transaction.on_commit(lambda: bump_version(FRAGMENTS_VERSION_KEY))
+    else:
+        Recipe.objects.filter(pk__in=recipe_ids).update(
+            fragment_revision=F('fragment_revision') + 1
+        )
+
+
+def invalidate_recipe(instance, created=False, **kwargs):
+    """
+    Обработчик post_save/post_delete для Recipe. Ингредиенты рецепта
+    меняются пачками: их сбрасывают set_ingredient_amounts и админка,
+    чтобы удаление оставалось одним DELETE без сигналов на строку
+    """
+    if not created:
+        # У нового рецепта фрагментов ещё нет
+        forget_recipe_fragments([instance.pk])
+    invalidate_tags(RECIPES_TAG)
+
+
+def invalidate_recipe_tags(instance, action, reverse, pk_set, **kwargs):
+    """Обработчик m2m_changed для Recipe.tags"""
+    if not action.startswith('post_'):
+        return
+    if not reverse:
+        forget_recipe_fragments([instance.pk])
+    else:
+        # Со стороны тэга: pk_set — id рецептов, при clear его нет
+        forget_recipe_fragments(pk_set)
+    invalidate_tags(RECIPES_TAG)
+
+
+def invalidate_catalogue(**kwargs):
+    """
+    Обработчик post_save/post_delete для Ingredient и Tag. Версия
+    справочников — она же тэг ответов CATALOGUE_TAG; тэги
+    и ингредиенты входят и в ответы с рецептами
+    """
+    forget_recipe_fragments()
+    invalidate_tags(CATALOGUE_TAG, RECIPES_TAG)
+
+
+def remember_author_changes(instance, update_fields=None, **kwargs):
+    """
+    Обработчик pre_save для User: запоминает, изменились ли поля,
+    которые входят в ответ с рецептом. Новый пользователь и вход
+    в систему (update_fields=['last_login']) их не меняют
+    """
+    instance._author_changed = False
+    if instance.pk is None or (
+        update_fields is not None
+        and not set(update_fields) & set(AUTHOR_FIELDS)
+    ):
+        return
+    saved = type(instance).objects.filter(pk=instance.pk).values(
+        *AUTHOR_FIELDS
+    ).first()
+    instance._author_changed = saved is not None and any(
+        saved[field] != getattr(instance, field) for field in AUTHOR_FIELDS
+    )
+
+
+def invalidate_author(instance, created, **kwargs):
+    """
+    Обработчик post_save для User: сбрасывает фрагменты рецептов автора
+    и ответы, в которые они вошли (см. ResponseCache.get)
+    """
+    if created or not getattr(instance, '_author_changed', False):
+        return
+    forget_recipe_fragments(
+        Recipe.objects.filter(author=instance.pk).values('pk')
+    )
+    key = AUTHOR_VERSION_KEY.format(instance.pk)
+    transaction.on_commit(lambda: bump_version(key))
+
+
+class CachedResponse:
+    """Отрендеренный ответ с валидаторами для условных запросов"""
+    headers = ('Vary', 'Allow')
+
+    def __init__(self, response, dependencies=None):
+        self.content = response.content
+        # Ключи версий и их значения на момент рендера, см. ResponseCache
+        self.dependencies = dependencies or {}
+        self.content_type = response['Content-Type']
+        self.extra_headers = {
+            header: response[header]
+            for header in self.headers if response.has_header(header)
+        }
+        self.etag = content_etag(self.content)
+        self.last_modified = int(time.time())
+
+    def to_response(self, request):
+        response = HttpResponse(
+            self.content, content_type=self.content_type
+        )
+        for header, value in self.extra_headers.items():
+            response[header] = value
+        response['ETag'] = self.etag
+        response['Last-Modified'] = http_date(self.last_modified)
+        response['Cache-Control'] = (
+            f'public, max-age={settings.RESPONSE_CACHE_MAX_AGE}'
+        )
+        # Ответ из кэша только для анонимов: общие кэши не должны
+        # отдавать его запросам с токеном
+        patch_vary_headers(response, ('Authorization',))
+        return get_conditional_response(
+            request, etag=self.etag, last_modified=self.last_modified,
+            response=response
+        )
+
+
+class ResponseCache:
+    """
+    Кэш ответов анонимам. Хранилище — отдельный алиас CACHES
+    (локальная память, файлы, Redis и т. п.), а версии тэгов лежат
+    в кэше состояния, так что сброс виден всем воркерам. Кроме тэгов ответ
+    может зависеть от версий отдельных объектов, например авторов:
+    они проверяются при чтении
+    """
+    alias = 'responses'
+
+    @property
+    def storage(self):
+        return caches[self.alias]
+
+    def make_key(self, request, tags):
+        query = urlencode(sorted(
+            (name, sorted(values)) for name, values in request.GET.lists()
+        ), doseq=True)
+        # Хост и схема входят в абсолютные ссылки на картинки
+        signature = hashlib.md5('|'.join((
+            request.scheme, request.get_host(), request.path, query,
+            request.META.get('HTTP_ACCEPT', '')
+        )).encode()).hexdigest()
+        versions = ':'.join(get_version(RESPONSE_TAGS[tag]) for tag in tags)
+        return f'response:{versions}:{signature}'
+
+    def get(self, key):
+        entry = self.storage.get(key)
+        # Ответ устарел, если сменилась версия того, что в него вошло
+        if entry is not None and entry.dependencies:
+            versions = state_cache().get_many(list(entry.dependencies))
+            if versions != entry.dependencies:
+                return None
+        return entry
+
+    def set(self, key, entry):
+        self.storage.set(key, entry, settings.RESPONSE_CACHE_TIMEOUT)
+
+
+response_cache = ResponseCache()
+
+
+class RecipeFragmentCache:
+    """
+    Неизменная для разных пользователей часть представления рецепта
+    (api/serializers.py). Лежит в своём алиасе CACHES: по умолчанию
+    в памяти воркера, при вытеснении фрагмент просто строится заново.
+    В ключе — ревизия рецепта из БД, поэтому удалять устаревшие
+    фрагменты в каждом воркере не нужно
+    """
+    @property
+    def storage(self):
+        return caches[FRAGMENTS_CACHE]
+
+    def make_key(self, recipe, version):
+        return (
+            f'recipe_fragment:{version}:{recipe.pk}:'
+            f'{recipe.fragment_revision}'
+        )
+
+    def get_many(self, recipes, builder):
+        """Недостающие фрагменты строит builder и сохраняет одним set_many"""
+        version = get_version(FRAGMENTS_VERSION_KEY)
+        keys = {self.make_key(recipe, version): recipe for recipe in recipes}
+        found = self.storage.get_many(keys)
+        missing = {
+            key: builder(recipe)
+            for key, recipe in keys.items() if key not in found
+        }
+        if missing:
+            self.storage.set_many(missing, settings.RECIPE_FRAGMENT_TIMEOUT)
+        found.update(missing)
+        return {recipe.pk: found[key] for key, recipe in keys.items()}
+
+
+recipe_fragments = RecipeFragmentCache()
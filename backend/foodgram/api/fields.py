@@ -1,73 +1,164 @@
-import base64
 import binascii
+from tempfile import SpooledTemporaryFile
 
-from django.core.exceptions import ValidationError
-from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
 from django.shortcuts import get_object_or_404
-from django.utils.translation import gettext_lazy as _
-from drf_extra_fields.fields import Base64FieldMixin, Base64ImageField
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework.relations import (
+    MANY_RELATION_KWARGS, ManyRelatedField, PrimaryKeyRelatedField
+)
 from rest_framework.serializers import CurrentUserDefault
 
-from api.utils import get_media_recipes_names
 from recipes.models import Recipe
 from users.models import User
 
 
 class CustomBase64ImageField(Base64ImageField):
+    """
+    Декодирует base64 по частям во временный файл: в памяти держится
+    не больше IMAGE_UPLOAD_SPOOL_SIZE байт, остальное уходит на диск.
+    Размер проверяется до декодирования.
+    Имя файла задаёт хранилище рецептов (recipes/storage.py) по хэшу
+    содержимого, поэтому проверять занятость имени не нужно
+    """
+    BASE64_HEADER = ';base64,'
+    # Кратно 4, чтобы куски декодировались независимо
+    CHUNK_SIZE = 64 * 1024
+
+    default_error_messages = {
+        'too_large': 'Размер картинки больше {max_size} байт',
+    }
+
+    def __init__(self, *args, **kwargs):
+        self.max_size = kwargs.pop('max_size', settings.RECIPE_IMAGE_MAX_SIZE)
+        super().__init__(*args, **kwargs)
+
     def to_internal_value(self, base64_data):
         if base64_data in self.EMPTY_VALUES:
             return None
 
-        if isinstance(base64_data, str):
-            file_mime_type = None
-
-            if ";base64," in base64_data:
-                header, base64_data = base64_data.split(";base64,")
-                if self.trust_provided_content_type:
-                    file_mime_type = header.replace("data:", "")
+        if not isinstance(base64_data, str):
+            self.fail('invalid_image')
+
+        file_mime_type = None
+        start = base64_data.find(self.BASE64_HEADER)
+        if start == -1:
+            start = 0
+        else:
+            if self.trust_provided_content_type:
+                file_mime_type = base64_data[:start].replace('data:', '')
+            start += len(self.BASE64_HEADER)
+
+        # Оценка сверху: 4 символа base64 дают 3 байта
+        if (len(base64_data) - start) // 4 * 3 > self.max_size:
+            self.fail('too_large', max_size=self.max_size)
+
+        file = SpooledTemporaryFile(max_size=settings.IMAGE_UPLOAD_SPOOL_SIZE)
+        try:
+            size = self.decode(base64_data, start, file)
+            image_format = self.validate_image(file)
+            extension = image_format.lower()
+            extension = 'jpg' if extension == 'jpeg' else extension
+            if extension not in self.ALLOWED_TYPES:
+                self.fail('invalid_image')
+        except Exception:
+            # Файл закрываем при любой ошибке, иначе он остаётся на диске
+            file.close()
+            raise
+
+        file.seek(0)
+        return UploadedFile(
+            file=file,
+            name=f'{self.get_file_name(None)}.{extension}',
+            content_type=file_mime_type or Image.MIME.get(image_format),
+            size=size
+        )
 
+    def decode(self, base64_data, start, file):
+        """Пишет декодированные данные в file, возвращает их размер"""
+        tail = b''
+        try:
+            for position in range(start, len(base64_data), self.CHUNK_SIZE):
+                chunk = base64_data[position:position + self.CHUNK_SIZE]
+                # Переносы строк допустимы в base64, но сбивают кратность 4
+                data = tail + ''.join(chunk.split()).encode('ascii')
+                usable = len(data) - len(data) % 4
+                file.write(binascii.a2b_base64(data[:usable]))
+                tail = data[usable:]
+            if tail:
+                raise binascii.Error('Incorrect padding')
+        except (binascii.Error, UnicodeEncodeError):
+            self.fail('invalid_image')
+
+        size = file.tell()
+        if size > self.max_size:
+            self.fail('too_large', max_size=self.max_size)
+        return size
+
+    def validate_image(self, file):
+        """
+        То же, что делает ImageField Django, но без копирования файла
+        в BytesIO. Возвращает формат картинки по версии Pillow
+        """
+        try:
+            file.seek(0)
+            image = Image.open(file)
+            image.verify()
+        except Exception:
+            self.fail('invalid_image')
+        return image.format
+
+
+class BulkPrimaryKeyRelatedField(PrimaryKeyRelatedField):
+    """
+    Если перед валидацией вызвать prefetch() со всеми ключами списка,
+    объекты берутся из одного запроса in_bulk, а не по запросу на ключ
+    """
+    _objects = None
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    @staticmethod
+    def _to_pk(data):
+        if isinstance(data, bool):
+            raise TypeError
+        return int(data)
+
+    def prefetch(self, data):
+        pks = []
+        for item in data:
             try:
-                decoded_file = base64.b64decode(base64_data)
-            except (TypeError, binascii.Error, ValueError):
-                raise ValidationError(self.INVALID_FILE_MESSAGE)
-
-            # Мой код ниже. Идея: генерировать имя, только если введённое имя
-            # уже занято другим файлом. Иначе использовать введённое имя,
-            # как указано в ТЗ
-
-            # data может быть отрезана условием выше (if self.trust...)
-            # а может и не быть
-            if header.startswith('data:'):
-                parse_start = header.index(':') + 1
-                parse_end = header.index('/')
-                file_name = header[parse_start:parse_end]
-            else:
-                parse_end = header.index('/')
-                file_name = header[:parse_end]
-
-            media_recipes_names = get_media_recipes_names()
-            if file_name in media_recipes_names:
-                file_name = self.get_file_name(decoded_file)
-            # Конец моего кода.
-            # Остальное скопировано у родителя Base64ImageField
-            file_extension = self.get_file_extension(file_name, decoded_file)
-
-            if file_extension not in self.ALLOWED_TYPES:
-                raise ValidationError(self.INVALID_TYPE_MESSAGE)
-
-            complete_file_name = file_name + "." + file_extension
-            data = SimpleUploadedFile(
-                name=complete_file_name,
-                content=decoded_file,
-                content_type=file_mime_type
-            )
-
-            return super(Base64FieldMixin, self).to_internal_value(data)
-
-        raise ValidationError(
-            _("Invalid type. This is not an base64 string: {}".format(
-                type(base64_data)))
-        )
+                pks.append(self._to_pk(item))
+            except (TypeError, ValueError):
+                continue
+        self._objects = self.get_queryset().in_bulk(pks)
+
+    def to_internal_value(self, data):
+        if self._objects is None:
+            return super().to_internal_value(data)
+
+        try:
+            pk = self._to_pk(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self._objects:
+            self.fail('does_not_exist', pk_value=data)
+        return self._objects[pk]
+
+
+class BulkManyRelatedField(ManyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, list):
+            self.child_relation.prefetch(data)
+        return super().to_internal_value(data)
 
 
 class AuthorDefault(CurrentUserDefault):
@@ -1,6 +1,6 @@
 from django_filters import rest_framework as filters
 
-from recipes.models import Favourite, Recipe, ShoppingCart, User, Tag
+from recipes.models import Recipe, User, Tag
 
 
 class RecipeFilterSet(filters.FilterSet):
@@ -21,41 +21,41 @@ class RecipeFilterSet(filters.FilterSet):
         field_name='tags__slug',
         to_field_name='slug',
     )
-
-    def filter_is_favorited(self, queryset, name, value):
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=(('popular', 'popular'),),
+        method='filter_ordering')
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию, ингредиентам и тексту"""
+        return queryset.search(value)
+
+    def filter_ordering(self, queryset, name, value):
+        """?ordering=popular — по затухающей популярности"""
+        return queryset.popular()
+
+    def filter_by_user_flag(self, queryset, flag, value):
+        """
+        Фильтрует переданный queryset по аннотации-флагу (EXISTS),
+        поэтому сочетается с остальными фильтрами и сохраняет сортировку
+        """
         user = self.request.user
-        is_favorited = self.request.query_params.get('is_favorited')
+        if user.is_anonymous:
+            # У анонима нет ни избранного, ни списка покупок
+            return queryset.none() if value == '1' else queryset
 
-        if user.is_authenticated:
-            favorites = Favourite.objects.filter(
-                user=user
-            ).values_list('recipe')
-        else:
-            favorites = Favourite.objects.none()
+        if flag not in queryset.query.annotations:
+            queryset = queryset.with_user_flags(user)
+        return queryset.filter(**{flag: value == '1'})
 
-        if is_favorited == '1':
-            return Recipe.objects.filter(id__in=favorites)
-        elif is_favorited == '0':
-            return Recipe.objects.exclude(id__in=favorites)
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_by_user_flag(queryset, 'is_favorited', value)
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        is_in_shopping_cart = self.request.query_params.get(
-            'is_in_shopping_cart'
+        return self.filter_by_user_flag(
+            queryset, 'is_in_shopping_cart', value
         )
 
-        if user.is_authenticated:
-            shopping_cart = ShoppingCart.objects.filter(
-                user=user
-            ).values_list('recipe')
-        else:
-            shopping_cart = ShoppingCart.objects.none()
-
-        if is_in_shopping_cart == '1':
-            return Recipe.objects.filter(id__in=shopping_cart)
-        elif is_in_shopping_cart == '0':
-            return Recipe.objects.exclude(id__in=shopping_cart)
-
     class Meta:
         model = Recipe
         fields = []
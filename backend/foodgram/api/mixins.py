@@ -1,8 +1,15 @@
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
 from django.shortcuts import get_object_or_404
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
 from rest_framework import mixins, status
 from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 
+from .cache import (CachedResponse, catalogue_cache, get_versions,
+                    response_cache)
 from recipes.models import Recipe
 
 
@@ -16,7 +23,9 @@ class CustomCreateModelMixin(
             }
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        # Запись и обновление счётчиков в сигналах — одна транзакция
+        with transaction.atomic():
+            serializer.save()
         return Response(
             status=status.HTTP_201_CREATED,
             data=serializer.data
@@ -53,3 +62,81 @@ class CustomDestroyModelMixin(
                 status=status.HTTP_204_NO_CONTENT
             )
         raise ValidationError(self.delete_error_msg)
+
+
+class CatalogueListMixin(
+    mixins.ListModelMixin
+):
+    """
+    list справочника отдаёт заранее отрендеренный JSON из кэша воркера
+    и отвечает 304, если у клиента уже актуальная версия
+    """
+    catalogue_key = None
+
+    def use_catalogue_cache(self, request):
+        return request.accepted_renderer.format == 'json'
+
+    def render_catalogue(self):
+        serializer = self.get_serializer(self.get_queryset(), many=True)
+        return JSONRenderer().render(serializer.data)
+
+    def list(self, request, *args, **kwargs):
+        assert self.catalogue_key is not None, (
+            'Задайте значение атрибуту catalogue_key'
+        )
+        if not self.use_catalogue_cache(request):
+            return super().list(request, *args, **kwargs)
+
+        entry = catalogue_cache.get_rendered(
+            self.catalogue_key, self.render_catalogue
+        )
+        if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+        if entry.etag in if_none_match or '*' in if_none_match:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(
+                entry.content, content_type='application/json'
+            )
+        response['ETag'] = entry.etag
+        patch_vary_headers(response, ('Accept',))
+        return response
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Ответы анонимам одинаковы для всех (флаги пользователя ложны),
+    поэтому GET без токена отдаётся из кэша ответов. Кэш сбрасывается
+    по тэгам response_cache_tags при изменении данных
+    """
+    response_cache_tags = ()
+    response_cache_actions = ('list', 'retrieve')
+
+    def get_response_cache_dependencies(self, response):
+        """Ключи версий отдельных объектов, которые вошли в ответ"""
+        return []
+
+    def use_response_cache(self, request):
+        # self.action ещё не задан: DRF выставляет его внутри dispatch
+        return (
+            request.method == 'GET'
+            and 'HTTP_AUTHORIZATION' not in request.META
+            and self.action_map.get('get') in self.response_cache_actions
+        )
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self.use_response_cache(request):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = response_cache.make_key(request, self.response_cache_tags)
+        entry = response_cache.get(key)
+        if entry is None:
+            response = super().dispatch(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            if hasattr(response, 'render'):
+                response.render()
+            entry = CachedResponse(response, get_versions(
+                self.get_response_cache_dependencies(response)
+            ))
+            response_cache.set(key, entry)
+        return entry.to_response(request)
@@ -1,5 +1,122 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.settings import api_settings
+
+from .cache import RECIPES_VERSION_KEY, get_version
 
 
 class ListPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class IdCursorPagination(CursorPagination):
+    """Страницы по курсору от последнего id: без COUNT(*) и OFFSET"""
+    ordering = '-id'
+    page_size_query_param = 'limit'
+
+
+class FeedPagination(ListPagination):
+    """
+    По умолчанию — обычные страницы с номерами. С ?pagination=cursor
+    лента отдаётся по курсору (для бесконечной прокрутки)
+    """
+    mode_query_param = 'pagination'
+    cursor_paginator = None
+
+    def use_cursor(self, queryset, request):
+        if request.query_params.get(self.mode_query_param) != 'cursor':
+            return False
+        # Курсор идёт по id: при другой сортировке (популярность, поиск)
+        # остаёмся на страницах с номерами, чтобы не потерять порядок
+        ordering = tuple(queryset.query.order_by)
+        return not ordering or ordering == (IdCursorPagination.ordering,)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(queryset, request):
+            self.cursor_paginator = IdCursorPagination()
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+def estimate_count(model):
+    """Оценка числа строк из статистики Postgres, без чтения таблицы"""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+            [model._meta.db_table]
+        )
+        row = cursor.fetchone()
+    return int(row[0]) if row else -1
+
+
+class CachedCountPaginator(Paginator):
+    """
+    Число объектов кэшируется по тексту SQL-запроса, то есть по набору
+    фильтров. Ключ включает версию, которая меняется при создании
+    и удалении рецептов
+    """
+    def __init__(self, *args, version_key, use_estimate=False, **kwargs):
+        self.version_key = version_key
+        self.use_estimate = use_estimate
+        super().__init__(*args, **kwargs)
+
+    @cached_property
+    def counted_queryset(self):
+        # Без сортировки и аннотаций: на число строк они не влияют
+        return self.object_list.order_by().values('pk')
+
+    def get_cache_key(self):
+        sql = str(self.counted_queryset.query)
+        signature = hashlib.md5(sql.encode()).hexdigest()
+        return f'count:{get_version(self.version_key)}:{signature}'
+
+    @cached_property
+    def count(self):
+        if self.use_estimate:
+            estimate = estimate_count(self.object_list.model)
+            if estimate >= settings.COUNT_ESTIMATE_THRESHOLD:
+                return estimate
+
+        try:
+            key = self.get_cache_key()
+        except EmptyResultSet:
+            return 0
+        count = cache.get(key)
+        if count is None:
+            count = self.counted_queryset.count()
+            cache.set(key, count, settings.COUNT_CACHE_TIMEOUT)
+        return count
+
+
+class RecipePagination(FeedPagination):
+    """
+    Для анонимного списка без фильтров на большой таблице вместо
+    COUNT(*) отдаётся оценка Postgres, в остальных случаях —
+    закэшированный на COUNT_CACHE_TIMEOUT секунд точный COUNT(*)
+    """
+    def paginate_queryset(self, queryset, request, view=None):
+        paging_params = {
+            self.page_query_param, self.page_size_query_param,
+            self.mode_query_param, api_settings.URL_FORMAT_OVERRIDE
+        }
+        unfiltered = not set(request.query_params) - paging_params
+        self.django_paginator_class = partial(
+            CachedCountPaginator, version_key=RECIPES_VERSION_KEY,
+            use_estimate=unfiltered and request.user.is_anonymous
+        )
+        return super().paginate_queryset(queryset, request, view)
@@ -0,0 +1,111 @@
+import csv
+
+from django.utils.html import escape
+from rest_framework.negotiation import DefaultContentNegotiation
+from rest_framework.renderers import BaseRenderer
+
+
+class ShoppingCartRenderer(BaseRenderer):
+    """
+    Базовый класс для выгрузки списка покупок. Строки отдаются по одной,
+    чтобы список можно было стримить, не собирая его целиком в памяти
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            # Ответ с ошибкой (например, 401), а не список ингредиентов
+            return '\n'.join(str(value) for value in data.values())
+        return ''.join(self.stream(data))
+
+    def stream(self, ingredients):
+        yield from self.header()
+        for ingredient in ingredients:
+            yield self.line(ingredient)
+        yield from self.footer()
+
+    def header(self):
+        return ()
+
+    def footer(self):
+        return ()
+
+    def line(self, ingredient):
+        raise NotImplementedError('Задайте формат строки в наследнике')
+
+
+class ShoppingCartTextRenderer(ShoppingCartRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def line(self, ingredient):
+        name = ingredient['name'].capitalize()
+        return (
+            f'{name} ({ingredient["measurement_unit"]}) — '
+            f'{ingredient["total_amount"]}\n'
+        )
+
+
+class _Echo:
+    """Псевдо-файл для csv.writer: возвращает строку вместо записи"""
+    def write(self, value):
+        return value
+
+
+class ShoppingCartCSVRenderer(ShoppingCartRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def __init__(self):
+        self.writer = csv.writer(_Echo())
+
+    def header(self):
+        yield self.writer.writerow(['name', 'measurement_unit', 'amount'])
+
+    def line(self, ingredient):
+        return self.writer.writerow([
+            ingredient['name'],
+            ingredient['measurement_unit'],
+            ingredient['total_amount']
+        ])
+
+
+class ShoppingCartHTMLRenderer(ShoppingCartRenderer):
+    """
+    Страница для печати: из браузера её можно сохранить в PDF
+    """
+    media_type = 'text/html'
+    format = 'html'
+
+    def header(self):
+        yield (
+            '<!DOCTYPE html>\n<html lang="ru">\n<head>\n'
+            '<meta charset="utf-8">\n<title>Список покупок</title>\n'
+            '</head>\n<body>\n<h1>Список покупок</h1>\n<table>\n'
+            '<tr><th>Ингредиент</th><th>Количество</th></tr>\n'
+        )
+
+    def line(self, ingredient):
+        name = escape(ingredient['name'].capitalize())
+        unit = escape(ingredient['measurement_unit'])
+        return (
+            f'<tr><td>{name}</td>'
+            f'<td>{ingredient["total_amount"]} {unit}</td></tr>\n'
+        )
+
+    def footer(self):
+        yield '</table>\n</body>\n</html>\n'
+
+
+class FormatParamContentNegotiation(DefaultContentNegotiation):
+    """
+    Формат выбирается только параметром ?format=. Заголовок Accept
+    игнорируется, по умолчанию используется первый рендерер
+    """
+    def select_renderer(self, request, renderers, format_suffix=None):
+        format_query_param = self.settings.URL_FORMAT_OVERRIDE
+        format = format_suffix or request.query_params.get(format_query_param)
+        if format:
+            renderers = self.filter_renderers(renderers, format)
+
+        return renderers[0], renderers[0].media_type
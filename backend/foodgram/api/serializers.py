@@ -1,13 +1,19 @@
 from collections import OrderedDict
 
+from django.db import transaction
+from django.db.models import Manager
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from rest_framework.fields import SkipField
 from rest_framework.relations import PKOnlyObject
 
-from .fields import AuthorDefault, CustomBase64ImageField, RecipeDefault
-from .utils import ingr_amount_bulk_create_plus
+from .cache import catalogue_cache, recipe_fragments
+from .fields import (AuthorDefault, BulkPrimaryKeyRelatedField,
+                     CustomBase64ImageField, RecipeDefault)
+from .utils import set_ingredient_amounts
 from recipes.models import (Favourite, Ingredient, IngredientAmount, Recipe,
                             ShoppingCart, Tag)
+from recipes.tasks import schedule_image_processing
 from users.models import Subscription, User
 
 
@@ -31,6 +37,16 @@ class UserCreateSerializer(serializers.ModelSerializer):
         return User.objects.create_user(**validated_data)
 
 
+def is_subscribed(user, author):
+    if user.is_anonymous:
+        return False
+    # Флаг мог быть заранее посчитан во вьюсете для всей страницы
+    if hasattr(author, 'is_subscribed'):
+        return author.is_subscribed
+
+    return Subscription.objects.filter(user=user, author=author).exists()
+
+
 class UserRetrieveSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
 
@@ -47,11 +63,7 @@ class UserRetrieveSerializer(serializers.ModelSerializer):
         ]
 
     def get_is_subscribed(self, obj):
-        user = self.context['request'].user
-        if user.is_anonymous:
-            return False
-
-        return Subscription.objects.filter(user=user, author=obj).exists()
+        return is_subscribed(self.context['request'].user, obj)
 
 
 class IngredientSerializer(serializers.ModelSerializer):
@@ -62,8 +74,18 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'name', 'measurement_unit']
 
 
+class IngredientAmountListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        # Все ингредиенты списка загружаются одним запросом
+        if isinstance(data, list):
+            self.child.fields['id'].prefetch(
+                item.get('id') for item in data if isinstance(item, dict)
+            )
+        return super().to_internal_value(data)
+
+
 class IngredientAmountSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
+    id = BulkPrimaryKeyRelatedField(
         queryset=Ingredient.objects.all(), source='ingredient'
     )
     name = serializers.CharField(
@@ -78,6 +100,7 @@ class IngredientAmountSerializer(serializers.ModelSerializer):
         model = IngredientAmount
         fields = ['id', 'name', 'measurement_unit', 'amount']
         read_only_fields = ['name', 'measurement_unit']
+        list_serializer_class = IngredientAmountListSerializer
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -88,9 +111,26 @@ class TagSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'name', 'color', 'slug']
 
 
+def get_tags_representation():
+    """Представления всех тэгов по id, для кэша справочников"""
+    return {
+        tag.id: TagSerializer(tag).data for tag in Tag.objects.all()
+    }
+
+
+class RecipeListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = list(data.all() if isinstance(data, Manager) else data)
+        if self.child.cache_fragments:
+            self.child.load_fragments(recipes)
+        return super().to_representation(recipes)
+
+
 class RecipeSerializer(serializers.ModelSerializer):
-    ingredients = IngredientAmountSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
+    ingredients = IngredientAmountSerializer(
+        many=True, source='ingredient_amounts'
+    )
+    tags = BulkPrimaryKeyRelatedField(
         queryset=Tag.objects.all(), many=True
     )
     author = UserRetrieveSerializer(default=serializers.CurrentUserDefault())
@@ -98,7 +138,12 @@ class RecipeSerializer(serializers.ModelSerializer):
     is_in_shopping_cart = serializers.SerializerMethodField()
     image = CustomBase64ImageField(use_url=True)
 
-    def to_representation(self, instance):
+    # Зависят от того, кто смотрит; остальное кэшируется (api/cache.py)
+    user_fields = ('is_favorited', 'is_in_shopping_cart')
+    cache_fragments = True
+
+    def serialize(self, instance):
+        """Общий путь через поля DRF, для сериализаторов-наследников"""
         ret = OrderedDict()
         fields = self._readable_fields
 
@@ -116,13 +161,117 @@ class RecipeSerializer(serializers.ModelSerializer):
             else:
                 # Мой код про тэги, остальное взято у родителя
                 if field.field_name == 'tags':
-                    serializer = TagSerializer(attribute, many=True)
-                    ret[field.field_name] = list(serializer.data)
+                    tags = catalogue_cache.get(
+                        'tags_representation', get_tags_representation
+                    )
+                    ret[field.field_name] = [
+                        tags.get(tag.pk) or TagSerializer(tag).data
+                        for tag in attribute
+                    ]
+                elif field.field_name == 'image' and instance.thumbnail \
+                        and self.context.get('use_thumbnails'):
+                    # В списках отдаём уменьшенную копию, если она готова
+                    ret[field.field_name] = field.to_representation(
+                        instance.thumbnail
+                    )
                 else:
                     ret[field.field_name] = field.to_representation(attribute)
 
         return ret
 
+    @cached_property
+    def tags_representation(self):
+        # Версия справочников проверяется один раз на запрос, а не на рецепт
+        return catalogue_cache.get(
+            'tags_representation', get_tags_representation
+        )
+
+    def build_fragment(self, instance):
+        """
+        Часть представления, одинаковая для всех пользователей.
+        Словари собираются прямо из подгруженных объектов, без полей DRF;
+        порядок ключей — как в Meta.fields. Флаги и ссылку на картинку
+        подставляет to_representation
+        """
+        tags = self.tags_representation
+        author = instance.author
+        return {
+            'data': {
+                'id': instance.pk,
+                'tags': [
+                    tags.get(tag.pk) or TagSerializer(tag).data
+                    for tag in instance.tags.all()
+                ],
+                'author': {
+                    'email': author.email,
+                    'id': author.pk,
+                    'username': author.username,
+                    'first_name': author.first_name,
+                    'last_name': author.last_name,
+                    'is_subscribed': None,
+                },
+                'ingredients': [
+                    {
+                        'id': amount.ingredient_id,
+                        'name': amount.ingredient.name,
+                        'measurement_unit': amount.ingredient.measurement_unit,
+                        'amount': amount.amount,
+                    }
+                    for amount in instance.ingredient_amounts.all()
+                ],
+                'is_favorited': None,
+                'is_in_shopping_cart': None,
+                'name': instance.name,
+                'image': None,
+                'text': instance.text,
+                'cooking_time': instance.cooking_time,
+            },
+            'image': instance.image.url if instance.image else None,
+            'thumbnail': (
+                instance.thumbnail.url if instance.thumbnail else None
+            ),
+        }
+
+    def load_fragments(self, instances):
+        """Фрагменты для всей страницы: один get_many и один set_many"""
+        self._fragments = recipe_fragments.get_many(
+            instances, self.build_fragment
+        )
+
+    def get_fragment(self, instance):
+        fragments = getattr(self, '_fragments', {})
+        if instance.pk in fragments:
+            return fragments[instance.pk]
+        return recipe_fragments.get_many(
+            [instance], self.build_fragment
+        )[instance.pk]
+
+    def get_image_url(self, fragment):
+        url = fragment['image']
+        if fragment['thumbnail'] and self.context.get('use_thumbnails'):
+            url = fragment['thumbnail']
+        request = self.context.get('request')
+        if url is not None and request is not None:
+            return request.build_absolute_uri(url)
+        return url
+
+    def to_representation(self, instance):
+        if not self.cache_fragments:
+            return self.serialize(instance)
+
+        fragment = self.get_fragment(instance)
+        ret = dict(fragment['data'])
+        # self.fields не трогаем: его сборка дороже самого представления
+        ret['author'] = dict(
+            ret['author'], is_subscribed=is_subscribed(
+                self.context['request'].user, instance.author
+            )
+        )
+        ret['is_favorited'] = self.get_is_favorited(instance)
+        ret['is_in_shopping_cart'] = self.get_is_in_shopping_cart(instance)
+        ret['image'] = self.get_image_url(fragment)
+        return ret
+
     class Meta:
         model = Recipe
         fields = [
@@ -134,11 +283,14 @@ class RecipeSerializer(serializers.ModelSerializer):
         read_only_fields = [
             'id', 'author', 'is_favorited', 'is_in_shopping_cart'
         ]
+        list_serializer_class = RecipeListSerializer
 
     def get_is_favorited(self, obj):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
 
         return Favourite.objects.filter(user=user, recipe=obj).exists()
 
@@ -146,12 +298,14 @@ class RecipeSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
 
         return ShoppingCart.objects.filter(user=user, recipe=obj).exists()
 
     def validate(self, data):
         tags = data.get('tags')
-        ingrs = data.get('ingredients')
+        ingrs = data.get('ingredient_amounts')
 
         tags_are_not_unique = len(set(tags)) < len(tags)
 
@@ -171,24 +325,47 @@ class RecipeSerializer(serializers.ModelSerializer):
             )
         return data
 
+    @transaction.atomic
     def create(self, validated_data):
         tags = validated_data.pop('tags')
-        ingredients = validated_data.pop('ingredients')
+        ingredients = validated_data.pop('ingredient_amounts')
 
         recipe = Recipe.objects.create(**validated_data)
-        recipe.tags.set(tags)
+        # У нового рецепта тэгов нет, сравнивать не с чем
+        RecipeTag = Recipe.tags.through
+        RecipeTag.objects.bulk_create(
+            RecipeTag(recipe=recipe, tag=tag) for tag in tags
+        )
+        set_ingredient_amounts(recipe, ingredients, created=True)
+        Recipe.objects.filter(pk=recipe.pk).update_search_index()
+        schedule_image_processing(recipe)
 
-        return ingr_amount_bulk_create_plus(ingredients, recipe)
+        return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredients = validated_data.pop('ingredients')
+        ingredients = validated_data.pop('ingredient_amounts')
 
         recipe = super().update(instance, validated_data)
+        if 'image' in validated_data:
+            # Старые варианты относятся к прежней картинке. Recipe.save
+            # их не пишет, чтобы не затереть результат фоновой задачи
+            Recipe.objects.filter(pk=recipe.pk).update(
+                thumbnail='', image_webp=''
+            )
+            recipe.thumbnail = recipe.image_webp = ''
+        set_ingredient_amounts(recipe, ingredients)
+        Recipe.objects.filter(pk=recipe.pk).update_search_index()
+        if 'image' in validated_data:
+            schedule_image_processing(recipe)
 
-        return ingr_amount_bulk_create_plus(ingredients, recipe)
+        return recipe
 
 
 class ShorterRecipeSerializer(RecipeSerializer):
+    # Набор полей другой, фрагменты полного рецепта не подходят
+    cache_fragments = False
+
     class Meta:
         model = Recipe
         fields = [
@@ -196,6 +373,26 @@ class ShorterRecipeSerializer(RecipeSerializer):
         ]
 
 
+class CookableRecipeSerializer(ShorterRecipeSerializer):
+    """Рецепт для поиска по имеющимся ингредиентам"""
+    coverage = serializers.FloatField(read_only=True)
+    missing_ingredients = serializers.SerializerMethodField()
+
+    class Meta(ShorterRecipeSerializer.Meta):
+        fields = ShorterRecipeSerializer.Meta.fields + [
+            'coverage', 'missing_ingredients'
+        ]
+
+    def get_missing_ingredients(self, obj):
+        available = self.context['available_ingredients']
+        # Ингредиенты рецепта уже подгружены во вьюсете
+        return [
+            IngredientSerializer(amount.ingredient).data
+            for amount in obj.ingredient_amounts.all()
+            if amount.ingredient_id not in available
+        ]
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     user = serializers.HiddenField(default=serializers.CurrentUserDefault())
     author = serializers.HiddenField(default=AuthorDefault())
@@ -229,12 +426,23 @@ class SubscriptionSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
 
         return Subscription.objects.filter(
             user=user, author=obj.author
         ).exists()
 
     def get_recipes(self, obj):
+        request = self.context.get('request')
+        # Рецепты уже подгружены во вьюсете для всей страницы
+        if hasattr(obj.author, 'latest_recipes'):
+            serializer = ShorterRecipeSerializer(
+                obj.author.latest_recipes, many=True,
+                context={'request': request, 'use_thumbnails': True}
+            )
+            return serializer.data
+
         # Фильтрация
         limit = self.context['recipes_limit']
         if limit is not None:
@@ -247,15 +455,15 @@ class SubscriptionSerializer(serializers.ModelSerializer):
                 author=obj.author
             ).order_by('-id')
 
-        request = self.context.get('request')
         serializer = ShorterRecipeSerializer(
-            qs, many=True, context={'request': request}
+            qs, many=True,
+            context={'request': request, 'use_thumbnails': True}
         )
 
         return serializer.data
 
     def get_recipes_count(self, obj):
-        return Recipe.objects.filter(author=obj.author).count()
+        return obj.author.recipes_count
 
     def validate(self, data):
         author = data.get('author')
@@ -0,0 +1,515 @@
+import base64
+import io
+import tempfile
+from tempfile import SpooledTemporaryFile
+from unittest import mock
+
+from django.core.cache import caches
+from django.db import connection
+from django.db.models import F
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ValidationError
+from rest_framework.test import APIClient
+
+from .cache import (RECIPES_VERSION_KEY, catalogue_cache, get_version,
+                    recipe_fragments)
+from .fields import CustomBase64ImageField
+from .utils import set_ingredient_amounts
+from .views import RecipeViewSet
+from recipes.models import (Favourite, Ingredient, IngredientAmount, Recipe,
+                            ShoppingCart, Tag)
+from users.models import Subscription, User
+
+TEST_CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-default',
+    },
+    'responses': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-responses',
+    },
+    'state': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-state',
+    },
+    'fragments': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'tests-fragments',
+    },
+}
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeQueryCountTests(TestCase):
+    """Число запросов к базе не зависит от числа рецептов на странице"""
+    recipes_count = 60
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass',
+            first_name='Reader', last_name='Reader'
+        )
+        cls.authors = [
+            User.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='pass', first_name='Author', last_name=str(i)
+            )
+            for i in range(3)
+        ]
+        Subscription.objects.create(user=cls.user, author=cls.authors[0])
+        cls.tags = [
+            Tag.objects.create(name=f'tag{i}', color='#ffffff', slug=f'tag{i}')
+            for i in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient{i}', measurement_unit='г'
+            )
+            for i in range(10)
+        ]
+        for i in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                author=cls.authors[i % len(cls.authors)],
+                name=f'recipe{i}', text='text', cooking_time=10,
+                image='recipes/images/recipe.png'
+            )
+            recipe.tags.set(cls.tags[:1 + i % len(cls.tags)])
+            IngredientAmount.objects.bulk_create(
+                IngredientAmount(
+                    recipe=recipe, ingredient=ingredient, amount=10 + k
+                )
+                for k, ingredient in enumerate(ingredients[i % 5:i % 5 + 4])
+            )
+            if i % 2:
+                Favourite.objects.create(user=cls.user, recipe=recipe)
+            if i % 3:
+                ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def setUp(self):
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def get(self, url):
+        # Число рецептов и фрагменты кэшируются, каждый запрос — с нуля
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            self.get(url)
+        return len(context.captured_queries)
+
+    def assertSameQueries(self, small_url, large_url):
+        expected = self.count_queries(small_url)
+        with self.assertNumQueries(expected):
+            self.get(large_url)
+
+    def test_list_queries_do_not_depend_on_page_size(self):
+        self.assertSameQueries(
+            '/api/recipes/?limit=1', '/api/recipes/?limit=50'
+        )
+
+    def test_retrieve_queries_do_not_depend_on_relations(self):
+        # Один тэг против трёх, разные авторы
+        first, third = Recipe.objects.order_by('id')[:3:2]
+        self.assertSameQueries(
+            f'/api/recipes/{first.pk}/', f'/api/recipes/{third.pk}/'
+        )
+
+    def test_filtered_list_queries_do_not_depend_on_page_size(self):
+        author = self.authors[0].pk
+        for query in ('tags=tag0', f'author={author}', 'is_favorited=1'):
+            with self.subTest(query=query):
+                self.assertSameQueries(
+                    f'/api/recipes/?{query}&limit=1',
+                    f'/api/recipes/?{query}&limit=50'
+                )
+
+    def test_user_flags_combine_with_filters(self):
+        recipes = Recipe.objects.all()
+        favourited = recipes.filter(favourited_recipes__user=self.user)
+        in_cart = recipes.filter(recipes_in_cart__user=self.user)
+        zeroth, first, second = (author.pk for author in self.authors)
+        cases = {
+            'is_favorited=1&tags=tag1': favourited.filter(tags__slug='tag1'),
+            f'is_favorited=1&author={second}': favourited.filter(
+                author=second
+            ),
+            'is_in_shopping_cart=1&tags=tag0': in_cart.filter(
+                tags__slug='tag0'
+            ),
+            f'is_in_shopping_cart=1&author={first}': in_cart.filter(
+                author=first
+            ),
+            # Рецепт с обоими тэгами не должен попасть в выдачу дважды
+            'is_favorited=1&is_in_shopping_cart=1&tags=tag1&tags=tag2': (
+                favourited & in_cart
+            ).filter(tags__slug__in=['tag1', 'tag2']),
+            f'is_in_shopping_cart=0&author={zeroth}': recipes.filter(
+                author=zeroth
+            ).exclude(recipes_in_cart__user=self.user),
+        }
+        for query, expected in cases.items():
+            with self.subTest(query=query):
+                results = self.get(
+                    f'/api/recipes/?{query}&limit=100'
+                ).json()['results']
+                expected = sorted(
+                    set(expected.values_list('id', flat=True)), reverse=True
+                )
+                self.assertTrue(expected)
+                self.assertEqual(
+                    [recipe['id'] for recipe in results], expected
+                )
+
+
+@override_settings(CACHES=TEST_CACHES)
+@mock.patch('api.cache.transaction.on_commit', lambda func: func())
+class CacheInvalidationTests(TestCase):
+    """Изменения сбрасывают только затронутые фрагменты и ответы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.other = [
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='pass',
+                first_name=name, last_name=name
+            )
+            for name in ('author', 'other')
+        ]
+        cls.recipe, cls.other_recipe = [
+            Recipe.objects.create(
+                author=author, name='recipe', text='text', cooking_time=10,
+                image='recipes/images/recipe.png'
+            )
+            for author in (cls.author, cls.other)
+        ]
+
+    def setUp(self):
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+
+    def get(self, recipe):
+        response = self.client.get(f'/api/recipes/{recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def assertCached(self, recipe):
+        with self.assertNumQueries(0):
+            self.get(recipe)
+
+    def test_rename_refreshes_only_authors_recipes(self):
+        self.get(self.recipe)
+        self.get(self.other_recipe)
+        self.author.first_name = 'renamed'
+        self.author.save()
+        self.assertEqual(self.get(self.recipe)['author']['first_name'],
+                         'renamed')
+        self.assertCached(self.other_recipe)
+
+    def test_rename_refreshes_lists(self):
+        self.client.get('/api/recipes/?limit=10')
+        self.author.username = 'renamed'
+        self.author.save()
+        usernames = {
+            recipe['author']['username']
+            for recipe in self.client.get(
+                '/api/recipes/?limit=10'
+            ).json()['results']
+        }
+        self.assertEqual(usernames, {'renamed', 'other'})
+
+    def test_other_changes_keep_caches(self):
+        self.get(self.recipe)
+        User.objects.create_user(
+            username='new', email='new@example.com', password='pass',
+            first_name='new', last_name='new'
+        )
+        self.author.set_password('changed')
+        self.author.save()
+        self.author.save(update_fields=['last_login'])
+        self.assertCached(self.recipe)
+        self.recipe.refresh_from_db()
+        fragment = recipe_fragments.get_many(
+            [self.recipe], lambda recipe: None
+        )[self.recipe.pk]
+        self.assertEqual(fragment['data']['author']['username'], 'author')
+
+    def test_ingredient_change_skips_stale_fragment(self):
+        ingredient = Ingredient.objects.create(
+            name='salt', measurement_unit='г'
+        )
+        # Фрагмент не удаляется: у рецепта новая ревизия и новый ключ
+        self.get(self.recipe)
+        set_ingredient_amounts(
+            self.recipe, [{'ingredient': ingredient, 'amount': 5}]
+        )
+        ingredients = self.get(self.recipe)['ingredients']
+        self.assertEqual([amount['name'] for amount in ingredients], ['salt'])
+
+    def test_stale_save_does_not_roll_back_revision(self):
+        # Фоновая задача подняла ревизию, пока рецепт был загружен
+        recipe = Recipe.objects.get(pk=self.recipe.pk)
+        Recipe.objects.filter(pk=recipe.pk).update(
+            fragment_revision=F('fragment_revision') + 1
+        )
+        revision = Recipe.objects.get(pk=recipe.pk).fragment_revision
+        recipe.name = 'renamed'
+        recipe.save()
+        self.assertEqual(
+            Recipe.objects.get(pk=recipe.pk).fragment_revision, revision + 1
+        )
+
+    def test_versions_survive_cache_clear(self):
+        version = get_version(RECIPES_VERSION_KEY)
+        for alias in ('default', 'responses', 'fragments'):
+            caches[alias].clear()
+        self.assertEqual(get_version(RECIPES_VERSION_KEY), version)
+
+
+class SimilarRecipesTests(TestCase):
+    def test_unknown_recipe_is_not_found(self):
+        for pk in ('abc', '0'):
+            with self.subTest(pk=pk):
+                response = self.client.get(f'/api/recipes/{pk}/similar/')
+                self.assertEqual(response.status_code, 404)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class ResponseCacheHeadersTests(TestCase):
+    """Заголовки ответов из кэша для анонимов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            username='user', email='user@example.com', password='pass',
+            first_name='user', last_name='user'
+        )
+        Tag.objects.create(name='tag', color='#ffffff', slug='tag')
+
+    def setUp(self):
+        catalogue_cache._version = None
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+
+    def test_cached_response_varies_on_authorization(self):
+        # Первый ответ кладётся в кэш, второй читается из него
+        for _ in range(2):
+            response = self.client.get('/api/tags/')
+            self.assertIn('Authorization', response['Vary'])
+
+    def test_catalogue_etag_does_not_depend_on_token(self):
+        token, _ = Token.objects.get_or_create(user=self.user)
+        anonymous = self.client.get('/api/tags/')
+        authorized = self.client.get(
+            '/api/tags/', HTTP_AUTHORIZATION=f'Token {token.key}'
+        )
+        self.assertEqual(anonymous['ETag'], authorized['ETag'])
+        response = self.client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=authorized['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+@override_settings(CACHES=TEST_CACHES)
+class RecipeWriteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Author', last_name='Author'
+        )
+        cls.reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass',
+            first_name='Reader', last_name='Reader'
+        )
+        cls.tag = Tag.objects.create(name='tag', color='#ffffff', slug='tag')
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'ingredient{i}', measurement_unit='г'
+            )
+            for i in range(3)
+        ]
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='recipe', text='text', cooking_time=10,
+            image='recipes/images/recipe.png'
+        )
+        cls.recipe.tags.set([cls.tag])
+        IngredientAmount.objects.create(
+            recipe=cls.recipe, ingredient=cls.ingredients[0], amount=10
+        )
+
+    def setUp(self):
+        token, _ = Token.objects.get_or_create(user=self.author)
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def payload(self, ingredients, **extra):
+        return {
+            'tags': [self.tag.pk],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': amount}
+                for ingredient, amount in ingredients
+            ],
+            'name': 'renamed', 'text': 'text', 'cooking_time': 5,
+            **extra
+        }
+
+    def patch(self, ingredients):
+        response = self.client.patch(
+            f'/api/recipes/{self.recipe.pk}/', self.payload(ingredients),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def create(self, ingredients):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG')
+        image = 'data:image/png;base64,{}'.format(
+            base64.b64encode(buffer.getvalue()).decode()
+        )
+        with tempfile.TemporaryDirectory() as media:
+            with override_settings(MEDIA_ROOT=media):
+                response = self.client.post(
+                    '/api/recipes/', self.payload(ingredients, image=image),
+                    format='json'
+                )
+        self.assertEqual(response.status_code, 201)
+        return response
+
+    def clear_caches(self):
+        # Справочник тэгов кэшируется в воркере, первый запрос его читает
+        catalogue_cache._version = None
+        for alias in TEST_CACHES:
+            caches[alias].clear()
+
+    def make_ingredients(self, count):
+        return Ingredient.objects.bulk_create(
+            Ingredient(name=f'bulk{i}', measurement_unit='г')
+            for i in range(count)
+        )
+
+    def test_create_queries_do_not_depend_on_ingredients(self):
+        # Токен, тэги, ингредиенты, savepoint, рецепт, счётчик автора,
+        # тэги, количества, поисковый индекс, release и ответ из пяти
+        ingredients = self.make_ingredients(40)
+        for count in (2, 40):
+            with self.subTest(ingredients=count):
+                self.clear_caches()
+                with self.assertNumQueries(15):
+                    self.create([(item, 3) for item in ingredients[:count]])
+
+    def test_update_queries_do_not_depend_on_ingredients(self):
+        ingredients = self.make_ingredients(40)
+        for count in (4, 40):
+            with self.subTest(ingredients=count):
+                IngredientAmount.objects.filter(recipe=self.recipe).delete()
+                IngredientAmount.objects.bulk_create(
+                    IngredientAmount(
+                        recipe=self.recipe, ingredient=item, amount=1
+                    )
+                    for item in ingredients[:count // 2]
+                )
+                self.clear_caches()
+                # Первая четверть удаляется, вторая меняется, вторая
+                # половина добавляется. Рецепт читается для проверки прав
+                # и для ответа, ревизия растёт от save и от ингредиентов
+                with self.assertNumQueries(23):
+                    self.patch(
+                        [(item, 2) for item in ingredients[count // 4:count]]
+                    )
+
+    def test_update_leaves_only_new_amounts(self):
+        first, second, third = self.ingredients
+        kept = IngredientAmount.objects.create(
+            recipe=self.recipe, ingredient=second, amount=20
+        )
+        # first удаляется, second меняется, third добавляется
+        self.patch([(second, 25), (third, 30)])
+        # По всей таблице: ни сирот, ни дублей
+        self.assertEqual(
+            sorted(IngredientAmount.objects.values_list(
+                'recipe', 'ingredient', 'amount'
+            )),
+            [(self.recipe.pk, second.pk, 25), (self.recipe.pk, third.pk, 30)]
+        )
+        kept.refresh_from_db()
+        self.assertEqual(kept.amount, 25)
+
+    def test_edit_keeps_concurrent_column_updates(self):
+        get_object = RecipeViewSet.get_object
+
+        def get_object_then_change(view):
+            recipe = get_object(view)
+            # Пока рецепт редактируется: избранное, затухание
+            # популярности и фоновая миниатюра
+            Favourite.objects.create(user=self.reader, recipe=recipe)
+            Recipe.objects.filter(pk=recipe.pk).update(
+                popularity=5, thumbnail='recipes/thumbnails/recipe.webp'
+            )
+            return recipe
+
+        with mock.patch.object(
+            RecipeViewSet, 'get_object', get_object_then_change
+        ):
+            self.patch([(self.ingredients[0], 10)])
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.name, 'renamed')
+        self.assertEqual(self.recipe.favourites_count, 1)
+        self.assertEqual(self.recipe.popularity, 5)
+        self.assertEqual(
+            self.recipe.thumbnail.name, 'recipes/thumbnails/recipe.webp'
+        )
+
+
+class Base64ImageFieldTests(TestCase):
+    def setUp(self):
+        buffer = io.BytesIO()
+        Image.new('RGB', (4, 4), 'red').save(buffer, 'PNG')
+        self.image = 'data:image/png;base64,{}'.format(
+            base64.b64encode(buffer.getvalue()).decode()
+        )
+        self.field = CustomBase64ImageField()
+
+    def test_invalid_payloads_fail_with_invalid_image(self):
+        payloads = {
+            'truncated': self.image[:-3],
+            'not a string': 5,
+            'not an image': 'data:image/png;base64,' + 'QUFB' * 10,
+        }
+        for name, payload in payloads.items():
+            with self.subTest(payload=name):
+                with self.assertRaises(ValidationError) as context:
+                    self.field.to_internal_value(payload)
+                self.assertEqual(
+                    context.exception.get_codes(), ['invalid_image']
+                )
+
+    def test_temp_file_is_closed_on_error(self):
+        files = []
+
+        def spooled_file(*args, **kwargs):
+            files.append(SpooledTemporaryFile(*args, **kwargs))
+            return files[-1]
+
+        with mock.patch('api.fields.SpooledTemporaryFile', spooled_file):
+            with self.assertRaises(ValidationError):
+                self.field.to_internal_value(
+                    'data:image/png;base64,' + 'QUFB' * 10
+                )
+        self.assertTrue(files[0].closed)
+
+    def test_valid_image(self):
+        file = self.field.to_internal_value(self.image)
+        self.assertTrue(file.name.endswith('.png'))
+        file.close()
@@ -1,28 +1,47 @@
-import os
-
-from django.conf import settings
-
+from .cache import RECIPES_TAG, forget_recipe_fragments, invalidate_tags
 from recipes.models import IngredientAmount
 
 
-def get_media_recipes_names():
-    """Для кастомного поля image в RecipeSerializer"""
-    dir_path = os.path.join(settings.MEDIA_ROOT, 'recipes/images/')
-    return os.listdir(dir_path)
-
-
-def ingr_amount_bulk_create_plus(ingredients, recipe):
-    """Для кастомных методов create и update в RecipeSerializer"""
-    ingredient_amounts = []
-    for ingr in ingredients:
-        ingredient_amounts.append(
-            IngredientAmount(
-                ingredient=ingr['ingredient'],
-                amount=ingr['amount']
-            )
+def set_ingredient_amounts(recipe, ingredients, created=False):
+    """
+    Для кастомных методов create и update в RecipeSerializer.
+    Сравнивает текущие и новые количества и меняет только то, что изменилось
+    """
+    new_amounts = {
+        ingr['ingredient'].id: ingr['amount'] for ingr in ingredients
+    }
+    current = {} if created else {
+        amount.ingredient_id: amount
+        for amount in IngredientAmount.objects.filter(recipe=recipe)
+    }
+
+    removed = [
+        amount.pk for ingredient_id, amount in current.items()
+        if ingredient_id not in new_amounts
+    ]
+    changed = []
+    for ingredient_id, amount in current.items():
+        new_amount = new_amounts.get(ingredient_id)
+        if new_amount is not None and new_amount != amount.amount:
+            amount.amount = new_amount
+            changed.append(amount)
+    added = [
+        IngredientAmount(
+            recipe=recipe, ingredient_id=ingredient_id, amount=amount
         )
-    IngredientAmount.objects.bulk_create(ingredient_amounts)
-
-    recipe.ingredients.set(ingredient_amounts)
+        for ingredient_id, amount in new_amounts.items()
+        if ingredient_id not in current
+    ]
+
+    if removed:
+        IngredientAmount.objects.filter(pk__in=removed).delete()
+    if changed:
+        IngredientAmount.objects.bulk_update(changed, ['amount'])
+    if added:
+        IngredientAmount.objects.bulk_create(added)
+    if not created and (removed or changed or added):
+        # Пачечные запросы сигналов не шлют, сбрасываем кэш сами
+        forget_recipe_fragments([recipe.pk])
+        invalidate_tags(RECIPES_TAG)
 
     return recipe
@@ -1,22 +1,32 @@
-from django.db.models import Q, Sum
-from django.http import HttpResponse
-from django.shortcuts import get_object_or_404
+from django.db import transaction
+from django.db.models import BooleanField, Prefetch, Value
+from django.http import StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser import utils
 from djoser.conf import settings
 from djoser.views import TokenCreateView as DjoserTokenCreateView
-from rest_framework import filters, mixins, status, viewsets
+from rest_framework import mixins, status, viewsets
+from rest_framework.decorators import action
 from rest_framework.exceptions import ValidationError
+from rest_framework.generics import get_object_or_404
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
+from .cache import (AUTHOR_VERSION_KEY, CATALOGUE_TAG, RECIPES_TAG,
+                    get_trending_ids)
 from .filtersets import RecipeFilterSet
-from .mixins import CustomCreateModelMixin, CustomDestroyModelMixin
-from .pagination import ListPagination
+from .mixins import (AnonymousResponseCacheMixin, CatalogueListMixin,
+                     CustomCreateModelMixin, CustomDestroyModelMixin)
+from .pagination import FeedPagination, ListPagination, RecipePagination
 from .permissions import HasAccessOrReadOnly
-from .serializers import (FavouritesSerializer, IngredientSerializer,
-                          RecipeSerializer, ShoppingCartSerializer,
-                          SubscriptionSerializer, TagSerializer)
+from .renderers import (FormatParamContentNegotiation,
+                        ShoppingCartCSVRenderer, ShoppingCartHTMLRenderer,
+                        ShoppingCartTextRenderer)
+from .serializers import (CookableRecipeSerializer, FavouritesSerializer,
+                          IngredientSerializer, RecipeSerializer,
+                          ShoppingCartSerializer, SubscriptionSerializer,
+                          TagSerializer)
 from recipes.models import (Favourite, Ingredient, IngredientAmount, Recipe,
                             ShoppingCart, Tag)
 from users.models import Subscription, User
@@ -32,36 +42,184 @@ class TokenCreateView(DjoserTokenCreateView):
         )
 
 
-class IngredientViewSet(viewsets.ReadOnlyModelViewSet):
+class IngredientViewSet(
+    AnonymousResponseCacheMixin,
+    CatalogueListMixin,
+    viewsets.ReadOnlyModelViewSet
+):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     permission_classes = (AllowAny,)
+    pagination_class = None
+    catalogue_key = 'ingredients'
+    response_cache_tags = (CATALOGUE_TAG,)
 
-    filter_backends = (filters.SearchFilter,)
-    search_fields = ('^name',)
+    autocomplete_limit = 20
+    autocomplete_max_limit = 100
 
-    pagination_class = None
+    def get_autocomplete_limit(self):
+        try:
+            limit = int(self.request.query_params.get(
+                'limit', self.autocomplete_limit
+            ))
+        except ValueError:
+            limit = self.autocomplete_limit
+        return max(1, min(limit, self.autocomplete_max_limit))
+
+    def get_queryset(self):
+        name = self.request.query_params.get(api_settings.SEARCH_PARAM)
+        if self.action != 'list' or not name:
+            return super().get_queryset()
 
+        return Ingredient.objects.autocomplete(
+            name, self.get_autocomplete_limit()
+        )
+
+    def use_catalogue_cache(self, request):
+        # Подсказки по названию в кэш справочника не попадают
+        return (
+            super().use_catalogue_cache(request)
+            and not request.query_params.get(api_settings.SEARCH_PARAM)
+        )
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+
+class TagViewSet(
+    AnonymousResponseCacheMixin,
+    CatalogueListMixin,
+    viewsets.ReadOnlyModelViewSet
+):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     permission_classes = (AllowAny,)
     pagination_class = None
+    catalogue_key = 'tags'
+    response_cache_tags = (CATALOGUE_TAG,)
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+class RecipeViewSet(
+    AnonymousResponseCacheMixin,
+    viewsets.ModelViewSet
+):
     http_method_names = ['get', 'post', 'patch', 'delete']
 
-    queryset = Recipe.objects.all().order_by('-id')
+    # Поисковые поля нужны только в WHERE, читать их незачем
+    queryset = Recipe.objects.defer(
+        'search_vector', 'ingredient_ids'
+    ).order_by('-id')
     serializer_class = RecipeSerializer
     permission_classes = (HasAccessOrReadOnly,)
-    pagination_class = ListPagination
+    pagination_class = RecipePagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilterSet
+    response_cache_tags = (RECIPES_TAG,)
+
+    def get_response_cache_dependencies(self, response):
+        """Ответ устаревает, когда автор рецепта меняет имя или почту"""
+        data = response.data
+        recipes = data['results'] if 'results' in data else [data]
+        return {
+            AUTHOR_VERSION_KEY.format(recipe['author']['id'])
+            for recipe in recipes
+        }
+
+    def get_queryset(self):
+        user = self.request.user
+        return super().get_queryset().with_related(user).with_user_flags(user)
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        context['use_thumbnails'] = self.action in (
+            'list', 'feed', 'trending', 'similar'
+        )
+        return context
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
+        self.reload_instance(serializer)
+
+    def perform_update(self, serializer):
+        serializer.save()
+        self.reload_instance(serializer)
+
+    def reload_instance(self, serializer):
+        # Ответ собирается из того же запроса, что и список: без N+1
+        serializer.instance = self.get_queryset().get(
+            pk=serializer.instance.pk
+        )
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь"""
+        queryset = self.filter_queryset(
+            self.get_queryset().feed(request.user)
+        )
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=False)
+    def trending(self, request):
+        """
+        Топ популярных рецептов. Список id берётся из кэша, который
+        обновляет decay_popularity, рецепты читаются по первичному ключу
+        """
+        ids = get_trending_ids()
+        try:
+            limit = int(request.query_params.get('limit', len(ids)))
+        except ValueError:
+            raise ValidationError({'limit': 'Ожидается число'})
+        ids = ids[:max(limit, 0)]
+
+        recipes = self.get_queryset().in_bulk(ids)
+        # Удалённые после пересчёта топа рецепты просто пропускаются
+        serializer = self.get_serializer(
+            [recipes[pk] for pk in ids if pk in recipes], many=True
+        )
+        return Response(serializer.data)
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        """Похожие рецепты из таблицы, построенной build_similar_recipes"""
+        # Версия DRF: на нечисловой pk отвечает 404, а не 500
+        get_object_or_404(Recipe.objects.only('pk'), pk=pk)
+        queryset = self.get_queryset().filter(
+            similar_to__recipe=pk
+        ).order_by('-similar_to__score', '-id')
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer.data)
+
+    def get_available_ingredients(self):
+        """?ingredients=1,2 или ?ingredients=1&ingredients=2"""
+        values = []
+        for value in self.request.query_params.getlist('ingredients'):
+            values.extend(value.split(','))
+        try:
+            ingredient_ids = {
+                int(value) for value in values if value.strip()
+            }
+        except ValueError:
+            raise ValidationError({'ingredients': 'Ожидаются id ингредиентов'})
+        if not ingredient_ids:
+            raise ValidationError(
+                {'ingredients': 'Укажите хотя бы один ингредиент'}
+            )
+        return ingredient_ids
+
+    @action(detail=False, url_path='what_can_i_cook')
+    def what_can_i_cook(self, request):
+        """Рецепты по имеющимся ингредиентам, от большего покрытия"""
+        available = self.get_available_ingredients()
+        queryset = self.filter_queryset(
+            self.get_queryset()
+        ).cookable_with(available)
+
+        # Курсор по id сломал бы сортировку по покрытию
+        pagination = ListPagination()
+        page = pagination.paginate_queryset(queryset, request, view=self)
+        context = self.get_serializer_context()
+        context.update(available_ingredients=available, use_thumbnails=True)
+        serializer = CookableRecipeSerializer(page, many=True, context=context)
+        return pagination.get_paginated_response(serializer.data)
 
 
 class SubscriptionViewSet(
@@ -77,14 +235,28 @@ class SubscriptionViewSet(
         return Subscription.objects.filter(user=self.request.user)
 
     def list(self, request, *args, **kwargs):
-        pagination = ListPagination()
+        recipes_limit = self.request.query_params.get('recipes_limit')
+        if recipes_limit is not None:
+            recipes_limit = int(recipes_limit)
+
+        # Рецепты всех авторов страницы приходят одним запросом,
+        # счётчик рецептов хранится в самом авторе
+        queryset = self.get_queryset().select_related('author').annotate(
+            is_subscribed=Value(True, output_field=BooleanField())
+        ).prefetch_related(Prefetch(
+            'author__author',
+            queryset=Recipe.objects.latest_per_author(recipes_limit),
+            to_attr='latest_recipes'
+        ))
+
+        pagination = FeedPagination()
         final_qs = pagination.paginate_queryset(
-            queryset=self.get_queryset(), request=request
+            queryset=queryset, request=request
         )
         serializer = self.serializer_class(
             final_qs, many=True, context={
                 'request': request,
-                'recipes_limit': self.request.query_params.get('recipes_limit')
+                'recipes_limit': recipes_limit
             }
         )
         return pagination.get_paginated_response(
@@ -99,7 +271,8 @@ class SubscriptionViewSet(
             }
         )
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        with transaction.atomic():
+            serializer.save()
         return Response(
             status=status.HTTP_201_CREATED,
             data=serializer.data
@@ -153,6 +326,11 @@ class ShoppingCartViewSet(
     serializer_class = ShoppingCartSerializer
     related_model = ShoppingCart
     delete_error_msg = 'Этого рецепта нет в списке покупок'
+    download_renderer_classes = (
+        ShoppingCartTextRenderer,
+        ShoppingCartCSVRenderer,
+        ShoppingCartHTMLRenderer,
+    )
 
     def get_queryset(self):
         return ShoppingCart.objects.filter(user=self.request.user)
@@ -165,34 +343,27 @@ class ShoppingCartViewSet(
             request, self.related_model, self.delete_error_msg, recipe_id
         )
 
-    def list(self, request):
-        qset = self.get_queryset()
-
-        recipe_ids = qset.values_list('recipe_id', flat=True)
-
-        ingredient_amounts_ids = Recipe.objects.filter(
-            id__in=recipe_ids
-        ).values('ingredients')
+    def get_renderers(self):
+        if self.action == 'list':
+            return [renderer() for renderer in self.download_renderer_classes]
+        return super().get_renderers()
 
-        ingredient_ids = IngredientAmount.objects.filter(
-            primary_key__in=ingredient_amounts_ids
-        ).values('ingredient_id')
+    def get_content_negotiator(self):
+        # Вызывается и до того, как вьюсет выставит action
+        if getattr(self, 'action', None) == 'list':
+            return FormatParamContentNegotiation()
+        return super().get_content_negotiator()
 
-        ingredients_info = Ingredient.objects.filter(
-            id__in=ingredient_ids
-        ).annotate(amount=Sum('ingredients__amount', filter=Q(
-            ingredients__primary_key__in=ingredient_amounts_ids)
-        )).values('name', 'amount', 'measurement_unit')
-
-        # Перевожу информацию в строку
-        text = ''
-
-        for obj in ingredients_info:
-            name = obj['name'].capitalize()
-            text += f'{name} ({obj["measurement_unit"]}) — {obj["amount"]}\n'
+    def list(self, request):
+        # Один GROUP BY запрос: корзина -> рецепт -> количество -> ингредиент
+        ingredients = IngredientAmount.objects.shopping_list(request.user)
 
-        response = HttpResponse(text, content_type='text/plain')
+        renderer = request.accepted_renderer
+        response = StreamingHttpResponse(
+            renderer.stream(ingredients.iterator()),
+            content_type=f'{renderer.media_type}; charset={renderer.charset}'
+        )
         response['Content-Disposition'] = (
-            'attachment;'
+            f'attachment; filename="shopping-list.{renderer.format}"'
         )
         return response
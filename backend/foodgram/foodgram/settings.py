@@ -1,4 +1,5 @@
 import os
+import tempfile
 
 from dotenv import load_dotenv
 
@@ -70,6 +71,61 @@ DATABASES = {
     }
 }
 
+# Общий для всех воркеров кэш короткоживущих значений (число рецептов)
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_cache')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    # Версии, топ популярных и отметки build_similar_recipes
+    # (api/cache.py): общие для воркеров и не вытесняются. Записей
+    # немного, поэтому лимит файлового кэша никогда не достигается;
+    # для Redis нужна политика noeviction
+    'state': {
+        'BACKEND': os.getenv(
+            'STATE_CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv(
+            'STATE_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_state')
+        ),
+        'OPTIONS': {
+            'MAX_ENTRIES': 10 ** 9,
+        },
+    },
+    # Фрагменты рецептов (api/serializers.py): вытеснение безопасно,
+    # фрагмент строится заново. По умолчанию — память воркера
+    'fragments': {
+        'BACKEND': os.getenv(
+            'FRAGMENT_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('FRAGMENT_CACHE_LOCATION', 'fragments'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', 10000)),
+        },
+    },
+    # Кэш ответов анонимам (api/mixins.py): локальная память воркера,
+    # файлы или Redis-совместимый бэкенд через переменные окружения
+    'responses': {
+        'BACKEND': os.getenv(
+            'RESPONSE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('RESPONSE_CACHE_LOCATION', 'responses'),
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -101,8 +157,71 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Картинки рецептов в base64: максимальный размер после декодирования
+# и сколько держать в памяти, прежде чем писать во временный файл
+RECIPE_IMAGE_MAX_SIZE = int(
+    os.getenv('RECIPE_IMAGE_MAX_SIZE', 10 * 1024 * 1024)
+)
+IMAGE_UPLOAD_SPOOL_SIZE = 1024 * 1024
+
+# Фоновая обработка картинок рецептов (recipes/tasks.py). Сверх
+# QUEUE_SIZE ожидающих задач новые выполняются сразу, в потоке запроса
+IMAGE_PROCESSING_BROKER = os.getenv(
+    'IMAGE_PROCESSING_BROKER', 'recipes.tasks.ThreadPoolBroker'
+)
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+IMAGE_PROCESSING_QUEUE_SIZE = int(
+    os.getenv('IMAGE_PROCESSING_QUEUE_SIZE', 100)
+)
+RECIPE_THUMBNAIL_SIZE = (480, 480)
+IMAGE_WEBP_QUALITY = 80
+
 AUTH_USER_MODEL = 'users.User'
 
+# Лента подписок (recipes/tasks.py). Рецепты авторов, у которых
+# подписчиков больше FEED_FANOUT_MAX_FOLLOWERS, в ленты не раскладываются
+# и читаются при запросе
+FEED_FANOUT_MAX_FOLLOWERS = 10000
+FEED_FANOUT_BATCH_SIZE = 1000
+# Раскладка по лентам идёт в своей очереди, чтобы не ждать картинок.
+# Потерянные при перезапуске задачи доделывает команда rebuild_timeline
+FEED_FANOUT_BROKER = os.getenv(
+    'FEED_FANOUT_BROKER', 'recipes.tasks.ThreadPoolBroker'
+)
+FEED_FANOUT_WORKERS = int(os.getenv('FEED_FANOUT_WORKERS', 2))
+FEED_FANOUT_QUEUE_SIZE = int(os.getenv('FEED_FANOUT_QUEUE_SIZE', 1000))
+
+# Популярность рецептов: вес события, период полураспада в часах
+# и сколько рецептов держать в закэшированном топе
+POPULARITY_WEIGHTS = {
+    'Favourite': 1.0,
+    'ShoppingCart': 2.0,
+}
+POPULARITY_HALF_LIFE_HOURS = 72
+TRENDING_SIZE = 50
+TRENDING_CACHE_TIMEOUT = 5 * 60
+
+# Похожие рецепты: сколько хранить на рецепт, вклад совместного избранного
+# и общих ингредиентов, с какой доли рецептов ингредиент считается частым
+SIMILAR_RECIPES_COUNT = 20
+SIMILAR_RECIPES_WEIGHTS = {
+    'favourites': 1.0,
+    'ingredients': 0.5,
+}
+SIMILAR_COMMON_INGREDIENT_SHARE = 0.05
+
+# Сколько хранить ответ анонимам на сервере и сколько — в браузере и nginx
+# до повторной проверки по ETag/Last-Modified
+RESPONSE_CACHE_TIMEOUT = 5 * 60
+RESPONSE_CACHE_MAX_AGE = 10
+
+# Сколько хранить неизменную часть представления рецепта
+RECIPE_FRAGMENT_TIMEOUT = 24 * 60 * 60
+
+# Кэш числа рецептов в постраничных списках (api/pagination.py)
+COUNT_CACHE_TIMEOUT = 30
+COUNT_ESTIMATE_THRESHOLD = 100000
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
         'rest_framework.authentication.TokenAuthentication',
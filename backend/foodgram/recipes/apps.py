@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class RecipesConfig(AppConfig):
     name = 'recipes'
+
+    def ready(self):
+        from recipes.signals import (connect_counters, connect_popularity,
+                                     connect_search_vectors,
+                                     connect_timelines)
+        connect_counters()
+        connect_popularity()
+        connect_search_vectors()
+        connect_timelines()
@@ -0,0 +1,111 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+
+from api.serializers import RecipeSerializer
+from recipes.models import Recipe
+from users.models import User
+
+
+class FieldsRecipeSerializer(RecipeSerializer):
+    """Прежний путь: каждое поле через объекты DRF"""
+    cache_fragments = False
+
+
+class UncachedRecipeSerializer(RecipeSerializer):
+    """Быстрые словари, но фрагменты строятся заново при каждом вызове"""
+    def load_fragments(self, instances):
+        self._fragments = {
+            instance.pk: self.build_fragment(instance)
+            for instance in instances
+        }
+
+
+SERIALIZERS = (
+    ('поля DRF', FieldsRecipeSerializer),
+    ('словари', UncachedRecipeSerializer),
+    ('словари + кэш', RecipeSerializer),
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает скорость сериализации списка рецептов: через поля DRF, '
+        'через сборку словарей и с кэшем фрагментов. Рецепты читаются '
+        'из базы один раз, запросы в замер не входят'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--sizes', type=int, nargs='+', default=[1, 50, 500],
+            help='Размеры страницы'
+        )
+        parser.add_argument(
+            '--repeat', type=int,
+            help='Повторов на размер; по умолчанию ~5000 рецептов'
+        )
+        parser.add_argument(
+            '--user', type=int,
+            help='id пользователя, от имени которого идёт запрос'
+        )
+
+    def get_request(self, user_id):
+        request = Request(RequestFactory().get('/api/recipes/'))
+        request.user = (
+            User.objects.get(pk=user_id) if user_id else AnonymousUser()
+        )
+        return request
+
+    def measure(self, serializer_class, recipes, context, repeat):
+        serializer_class(recipes, many=True, context=context).data
+        started = time.perf_counter()
+        for _ in range(repeat):
+            serializer_class(recipes, many=True, context=context).data
+        return (time.perf_counter() - started) / repeat
+
+    def handle(self, *args, **options):
+        request = self.get_request(options['user'])
+        context = {'request': request, 'use_thumbnails': True}
+        renderer = JSONRenderer()
+
+        for size in options['sizes']:
+            recipes = list(
+                Recipe.objects.with_related(request.user).with_user_flags(
+                    request.user
+                ).order_by('-id')[:size]
+            )
+            if len(recipes) < size:
+                self.stderr.write(
+                    f'В базе только {len(recipes)} рецептов из {size}'
+                )
+            if not recipes:
+                continue
+
+            rendered = {
+                renderer.render(serializer_class(
+                    recipes, many=True, context=context
+                ).data)
+                for _, serializer_class in SERIALIZERS
+            }
+            if len(rendered) != 1:
+                raise CommandError(f'JSON отличается для {size} рецептов')
+
+            repeat = options['repeat'] or max(1, 5000 // len(recipes))
+            timings = [
+                (label, self.measure(
+                    serializer_class, recipes, context, repeat
+                ))
+                for label, serializer_class in SERIALIZERS
+            ]
+            baseline = timings[0][1]
+            self.stdout.write(f'{len(recipes)} рецептов, {repeat} повторов:')
+            for label, seconds in timings:
+                self.stdout.write(
+                    f'  {label}: {seconds * 1000:.3f} мс, '
+                    f'{len(recipes) / seconds:.0f} рецептов/с, '
+                    f'x{baseline / seconds:.1f}'
+                )
@@ -0,0 +1,195 @@
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Max
+
+from api.cache import state_cache
+from recipes.models import Favourite, IngredientAmount, Recipe, SimilarRecipe
+
+WATERMARKS_KEY = 'similar_recipes_watermarks'
+
+# Косинусная близость по двум разреженным матрицам: рецепт × пользователь
+# (избранное) и рецепт × ингредиент. Произведения матриц считает Postgres
+# для одной пачки рецептов за раз, поэтому память не растёт с таблицей
+BUILD_SQL = '''
+WITH source AS (
+    SELECT id, favourites_count, ARRAY(
+        SELECT unnest(ingredient_ids)
+        EXCEPT SELECT unnest(%(common)s::integer[])
+    ) AS ingredients
+    FROM {recipe}
+    WHERE id = ANY(%(ids)s)
+),
+together AS (
+    SELECT first.recipe_id, second.recipe_id AS similar_id,
+           count(*) AS together
+    FROM {favourite} first
+    JOIN {favourite} second
+      ON second.user_id = first.user_id
+     AND second.recipe_id <> first.recipe_id
+    WHERE first.recipe_id = ANY(%(ids)s)
+    GROUP BY 1, 2
+),
+shared AS (
+    SELECT source.id AS recipe_id, other.id AS similar_id, (
+        SELECT count(*) FROM unnest(other.ingredient_ids) AS item
+        WHERE item = ANY(source.ingredients)
+    ) AS shared
+    FROM source
+    JOIN {recipe} other
+      ON other.ingredient_ids && source.ingredients
+     AND other.id <> source.id
+),
+scored AS (
+    SELECT recipe_id, similar_id,
+        %(favourites_weight)s * coalesce(together, 0) / sqrt(
+            greatest(source.favourites_count, 1)
+            * greatest(other.favourites_count, 1)
+        )
+        + %(ingredients_weight)s * coalesce(shared, 0) / sqrt(
+            greatest(cardinality(source.ingredients), 1)
+            * greatest(cardinality(other.ingredient_ids), 1)
+        ) AS score
+    FROM together
+    FULL JOIN shared USING (recipe_id, similar_id)
+    JOIN source ON source.id = recipe_id
+    JOIN {recipe} other ON other.id = similar_id
+),
+ranked AS (
+    SELECT recipe_id, similar_id, score, row_number() OVER (
+        PARTITION BY recipe_id ORDER BY score DESC, similar_id DESC
+    ) AS position
+    FROM scored
+)
+INSERT INTO {similar} (recipe_id, similar_id, score)
+SELECT recipe_id, similar_id, score FROM ranked
+WHERE position <= %(count)s
+'''
+
+
+class Command(BaseCommand):
+    help = (
+        'Строит таблицу похожих рецептов по совместному избранному '
+        'и общим ингредиентам. По умолчанию пересчитывает только рецепты, '
+        'затронутые новым избранным и новыми рецептами с прошлого запуска, '
+        'и их соседей. Удаления из избранного, правки ингредиентов и смену '
+        'частых ингредиентов учитывает только --full'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Пересчитать все рецепты'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=500,
+            help='Сколько рецептов пересчитывать за один запрос'
+        )
+
+    def get_common_ingredients(self):
+        """
+        Ингредиенты, которые есть почти везде (соль, вода), похожести
+        не добавляют, а пересечение по ним затронуло бы всю таблицу
+        """
+        threshold = (
+            Recipe.objects.count() * settings.SIMILAR_COMMON_INGREDIENT_SHARE
+        )
+        return list(IngredientAmount.objects.values(
+            'ingredient'
+        ).annotate(
+            recipes=Count('recipe', distinct=True)
+        ).filter(
+            recipes__gt=max(threshold, 1)
+        ).values_list('ingredient', flat=True))
+
+    def get_changed_recipes(self, watermarks, common):
+        """
+        Рецепты, у которых мог измениться топ: затронутые сами и их соседи
+        """
+        favourite_watermark, recipe_watermark = watermarks
+        # Новое избранное меняет совместные счётчики у рецептов этого
+        # пользователя и число добавлений рецепта, а оно входит в оценку
+        # у всех рецептов, с которыми он делит избранное
+        favourited = Favourite.objects.filter(
+            primary_key__gt=favourite_watermark
+        ).values('recipe')
+        users = Favourite.objects.filter(
+            recipe__in=favourited
+        ).values('user')
+        co_favourited = Favourite.objects.filter(
+            user__in=users
+        ).values_list('recipe', flat=True)
+        # Новый рецепт может попасть в топ любого рецепта с общим
+        # ингредиентом; частые ингредиенты оценку не меняют
+        created = Recipe.objects.filter(
+            id__gt=recipe_watermark
+        ).values_list('id', flat=True)
+        ingredients = IngredientAmount.objects.filter(
+            recipe__in=created
+        ).exclude(ingredient__in=common).values('ingredient')
+        sharing = IngredientAmount.objects.filter(
+            ingredient__in=ingredients
+        ).values_list('recipe', flat=True)
+        return co_favourited.union(created, sharing).order_by('recipe')
+
+    def build_chunk(self, cursor, ids, common):
+        SimilarRecipe.objects.filter(recipe__in=ids).delete()
+        cursor.execute(
+            BUILD_SQL.format(
+                recipe=Recipe._meta.db_table,
+                favourite=Favourite._meta.db_table,
+                similar=SimilarRecipe._meta.db_table,
+            ),
+            {
+                'ids': ids,
+                'common': common,
+                'count': settings.SIMILAR_RECIPES_COUNT,
+                'favourites_weight': settings.SIMILAR_RECIPES_WEIGHTS[
+                    'favourites'
+                ],
+                'ingredients_weight': settings.SIMILAR_RECIPES_WEIGHTS[
+                    'ingredients'
+                ],
+            }
+        )
+        return cursor.rowcount
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        # Границы берутся до пересчёта: то, что добавят во время него,
+        # попадёт в следующий запуск
+        current = (
+            Favourite.objects.aggregate(last=Max('primary_key'))['last'] or 0,
+            Recipe.objects.aggregate(last=Max('id'))['last'] or 0,
+        )
+        watermarks = None if options['full'] else state_cache().get(
+            WATERMARKS_KEY
+        )
+        common = self.get_common_ingredients()
+        if watermarks is None:
+            recipes = Recipe.objects.order_by('id').values_list(
+                'id', flat=True
+            )
+        else:
+            recipes = self.get_changed_recipes(watermarks, common)
+
+        ids = recipes.iterator()
+        total = pairs = 0
+        with connection.cursor() as cursor:
+            while True:
+                chunk = list(islice(ids, options['chunk_size']))
+                if not chunk:
+                    break
+                with transaction.atomic():
+                    pairs += self.build_chunk(cursor, chunk, common)
+                total += len(chunk)
+        state_cache().set(WATERMARKS_KEY, current, timeout=None)
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(
+            f'Пересчитано рецептов: {total}, пар: {pairs}, '
+            f'частых ингредиентов: {len(common)}, {elapsed:.2f} с'
+        )
@@ -0,0 +1,122 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.db.models import Count
+
+from recipes.models import Favourite, IngredientAmount, Recipe, Tag
+from users.models import Subscription, User
+
+
+def find_seq_scans(plan):
+    """Таблицы, которые в плане читаются целиком"""
+    tables = []
+    if plan.get('Node Type') == 'Seq Scan':
+        tables.append(plan['Relation Name'])
+    for child in plan.get('Plans', ()):
+        tables.extend(find_seq_scans(child))
+    return tables
+
+
+def find_indexes(plan):
+    """Индексы, которые читает план"""
+    indexes = set()
+    if 'Index Name' in plan:
+        indexes.add(plan['Index Name'])
+    for child in plan.get('Plans', ()):
+        indexes |= find_indexes(child)
+    return indexes
+
+
+# Индексы из recipes.0011 и users.0006, ради которых они добавлены
+EXPECTED_INDEXES = {
+    'рецепты автора': 'recipe_author_latest',
+    'последние рецепты авторов': 'recipe_author_latest',
+    'фильтр по тэгу': 'recipes_recipe_tags_tag_recipe',
+    'ингредиенты рецептов': 'ingredient_amount_covering',
+    'подписки': 'subscription_user_latest',
+    'лента подписок': 'recipe_author_latest',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет EXPLAIN для частых запросов API с выключенным '
+        'seq scan. Если запрос всё равно читает таблицу целиком '
+        'или не использует предназначенный ему индекс, команда '
+        'завершается с ошибкой'
+    )
+
+    def get_queries(self, user, recipe, tag):
+        author = recipe.author_id
+        recipes = Recipe.objects.order_by('-id')
+        return {
+            'список рецептов': recipes.with_user_flags(user)[:10],
+            'рецепты автора': recipes.filter(author=author)[:10],
+            'последние рецепты авторов': Recipe.objects.latest_per_author(
+                3
+            ).filter(author__in=[author]),
+            'фильтр по тэгу': recipes.filter(tags__slug=tag.slug)[:10],
+            'избранное': recipes.with_user_flags(user).filter(
+                is_favorited=True
+            )[:10],
+            'ингредиенты рецептов': IngredientAmount.objects.filter(
+                recipe__in=[recipe.pk]
+            ),
+            'список покупок': IngredientAmount.objects.shopping_list(user),
+            'подписки': Subscription.objects.filter(
+                user=user
+            ).order_by('-id')[:10],
+            'проверка подписки': Subscription.objects.filter(
+                user=user, author=author
+            ),
+            'проверка избранного': Favourite.objects.filter(
+                user=user, recipe=recipe
+            ),
+            'избранное рецепта': Favourite.objects.filter(recipe=recipe),
+            'лента подписок': recipes.feed(user)[:10],
+            'что приготовить': Recipe.objects.cookable_with(
+                recipe.ingredient_ids or [0]
+            )[:10],
+            'популярные': Recipe.objects.popular()[:10],
+            'похожие рецепты': recipes.filter(
+                similar_to__recipe=recipe
+            ).order_by('-similar_to__score', '-id'),
+        }
+
+    def handle(self, *args, **options):
+        # Подписчик, рецепт с ингредиентами и самый редкий тэг —
+        # на них планы ближе всего к тем, что видит API
+        user = User.objects.annotate(
+            subscriptions_count=Count('subscriber')
+        ).order_by('-subscriptions_count', 'id').first()
+        recipe = Recipe.objects.filter(
+            ingredient_amounts__isnull=False
+        ).order_by('id').first()
+        tag = Tag.objects.annotate(
+            recipes_count=Count('recipe')
+        ).order_by('recipes_count', 'id').first()
+        if None in (user, recipe, tag):
+            raise CommandError('Нужен хотя бы один пользователь, рецепт и тэг')
+
+        failed = []
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            for label, queryset in self.get_queries(user, recipe, tag).items():
+                sql, params = queryset.query.sql_with_params()
+                cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+                # psycopg2 сам разбирает JSON
+                plan = cursor.fetchone()[0][0]['Plan']
+                tables = find_seq_scans(plan)
+                expected = EXPECTED_INDEXES.get(label)
+                if tables:
+                    failed.append(label)
+                    self.stdout.write(
+                        f'{label}: seq scan по {", ".join(tables)}'
+                    )
+                elif expected and expected not in find_indexes(plan):
+                    failed.append(label)
+                    self.stdout.write(f'{label}: не использует {expected}')
+                else:
+                    self.stdout.write(f'{label}: ok')
+
+        if failed:
+            raise CommandError(f'Запросы без индекса: {", ".join(failed)}')
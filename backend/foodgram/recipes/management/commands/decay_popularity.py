@@ -0,0 +1,59 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from api.cache import refresh_trending_ids
+from recipes.models import PopularityDecay, Recipe
+
+# Меньшие значения обнуляются, чтобы не обновлять их при каждом запуске
+MIN_POPULARITY = 0.01
+
+
+class Command(BaseCommand):
+    help = (
+        'Уменьшает популярность рецептов пропорционально времени с прошлого '
+        'запуска (период полураспада POPULARITY_HALF_LIFE_HOURS) '
+        'и пересчитывает закэшированный топ. Запускается по cron'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--hours', type=float,
+            help='Сколько часов прошло; по умолчанию — с прошлого запуска'
+        )
+
+    def get_elapsed_hours(self, now):
+        decay = PopularityDecay.objects.select_for_update().first()
+        if decay is None:
+            # Первый запуск: только запоминаем время и пересчитываем топ
+            return 0
+        return max((now - decay.decayed_at).total_seconds(), 0) / 3600
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        hours = options['hours']
+        decayed = 0
+        # Отметка меняется вместе с популярностью: упавший или
+        # параллельный запуск не уменьшит её дважды
+        with transaction.atomic():
+            if hours is None:
+                hours = self.get_elapsed_hours(now)
+            factor = 0.5 ** (hours / settings.POPULARITY_HALF_LIFE_HOURS)
+            if factor < 1:
+                decayed = Recipe.objects.filter(
+                    popularity__gte=MIN_POPULARITY
+                ).update(popularity=F('popularity') * factor)
+                Recipe.objects.filter(
+                    popularity__gt=0, popularity__lt=MIN_POPULARITY
+                ).update(popularity=0)
+            PopularityDecay.objects.update_or_create(
+                pk=1, defaults={'decayed_at': now}
+            )
+
+        trending = refresh_trending_ids()
+        self.stdout.write(
+            f'Прошло часов: {hours:.2f}, множитель {factor:.4f}, '
+            f'обновлено рецептов: {decayed}, в топе: {len(trending)}'
+        )
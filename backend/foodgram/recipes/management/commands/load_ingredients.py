@@ -0,0 +1,159 @@
+import csv
+import io
+import json
+import os
+import time
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.cache import bump_catalogue_version
+from recipes.models import Ingredient
+
+STAGING_TABLE = 'recipes_ingredient_staging'
+
+
+def read_csv(file):
+    """Строки вида 'название,единица измерения', без заголовка"""
+    reader = csv.reader(file)
+    for row in reader:
+        if not row:
+            continue
+        if len(row) < 2:
+            raise CommandError(
+                f'Строка {reader.line_num}: ожидается название '
+                'и единица измерения'
+            )
+        yield row[0], row[1]
+
+
+def json_row(obj, offset):
+    try:
+        return obj['name'], obj['measurement_unit']
+    except (KeyError, TypeError):
+        raise CommandError(
+            f'Байт {offset}: ожидается объект с name и measurement_unit'
+        )
+
+
+def read_json(file, buffer_size=64 * 1024):
+    """
+    Потоково читает JSON-массив объектов {name, measurement_unit},
+    не загружая весь файл в память
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    # Сколько байт файла уже разобрано, для сообщений об ошибках
+    offset = 0
+    started = False
+
+    for chunk in iter(lambda: file.read(buffer_size), ''):
+        buffer += chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and position < len(buffer):
+                if buffer[position] != '[':
+                    raise CommandError('Ожидается JSON-массив')
+                started = True
+                position += 1
+                continue
+            if position >= len(buffer) or buffer[position] == ']':
+                break
+            try:
+                obj, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # Объект обрезан границей чанка, дочитываем файл
+                break
+            yield json_row(obj, offset + len(buffer[:position].encode()))
+            position = end
+        offset += len(buffer[:position].encode())
+        buffer = buffer[position:]
+
+    # Файл кончился: остаток — только закрывающая скобка. Иначе объект
+    # испорчен или обрезан, и молча терять его нельзя
+    if buffer.strip(' \t\r\n,') != (']' if started else ''):
+        raise CommandError(f'Байт {offset}: некорректный JSON')
+
+
+READERS = {
+    'csv': read_csv,
+    'json': read_json,
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV или JSON через COPY во временную '
+        'таблицу и добавляет новые в recipes_ingredient'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу с ингредиентами')
+        parser.add_argument(
+            '--format', choices=READERS.keys(),
+            help='Формат файла, по умолчанию — по расширению'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=10000,
+            help='Сколько строк отправлять в одном COPY'
+        )
+
+    def copy_chunk(self, cursor, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor.copy_expert(
+            f'COPY {STAGING_TABLE} (name, measurement_unit) '
+            'FROM STDIN WITH (FORMAT csv)',
+            buffer
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = (
+            options['format'] or os.path.splitext(path)[1].lstrip('.').lower()
+        )
+        if file_format not in READERS:
+            raise CommandError(f'Неизвестный формат файла: {path}')
+
+        table = Ingredient._meta.db_table
+        started = time.monotonic()
+        total = 0
+
+        with open(path, encoding='utf-8') as file, \
+                transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMP TABLE {STAGING_TABLE} '
+                '(name varchar(150), measurement_unit varchar(150)) '
+                'ON COMMIT DROP'
+            )
+            rows = (
+                (name.strip(), unit.strip())
+                for name, unit in READERS[file_format](file)
+            )
+            while True:
+                chunk = list(islice(rows, options['chunk_size']))
+                if not chunk:
+                    break
+                self.copy_chunk(cursor, chunk)
+                total += len(chunk)
+
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT name, measurement_unit FROM {STAGING_TABLE} '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            inserted = cursor.rowcount
+
+        # bulk-вставка не вызывает сигналы, версию справочника меняем сами
+        bump_catalogue_version()
+
+        elapsed = time.monotonic() - started
+        rate = total / elapsed if elapsed else total
+        self.stdout.write(
+            f'Прочитано строк: {total}, добавлено новых: {inserted}, '
+            f'{elapsed:.2f} с ({rate:.0f} строк/с)'
+        )
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from recipes.models import Recipe
+from recipes.tasks import process_recipe_image
+
+
+class Command(BaseCommand):
+    help = (
+        'Делает уменьшенные копии и WebP-версии для рецептов, у которых '
+        'их ещё нет (например, загруженных до фоновой обработки)'
+    )
+
+    def handle(self, *args, **options):
+        pending = Recipe.objects.filter(thumbnail='').exclude(
+            image=''
+        ).values_list('pk', flat=True)
+        processed = 0
+
+        for recipe_id in pending.iterator():
+            try:
+                process_recipe_image(recipe_id)
+            except (OSError, ValueError) as error:
+                self.stderr.write(f'Рецепт {recipe_id}: {error}')
+                continue
+            processed += 1
+
+        self.stdout.write(f'Обработано рецептов: {processed}')
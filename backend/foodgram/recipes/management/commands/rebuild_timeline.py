@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from recipes.tasks import rebuild_timeline
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = (
+        'Собирает ленты подписок заново: восстанавливает раскладку, '
+        'потерянную при перезапуске воркеров, и добавляет рецепты '
+        'авторов, которые перестали быть популярными. Без --user '
+        'обрабатывает всех пользователей с подписками'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='id пользователя; можно указать несколько раз'
+        )
+
+    def handle(self, *args, **options):
+        users = options['users']
+        if not users:
+            users = Subscription.objects.values_list(
+                'user_id', flat=True
+            ).distinct().order_by('user_id').iterator()
+
+        rebuilt = 0
+        for user_id in users:
+            rebuild_timeline(user_id)
+            rebuilt += 1
+
+        self.stdout.write(f'Пересобрано лент: {rebuilt}')
@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recipes.signals import COUNTERS
+
+
+def count_subquery(source, relation):
+    """Настоящее значение счётчика для каждой строки внешнего запроса"""
+    return Coalesce(
+        Subquery(
+            source.objects.filter(
+                **{relation: OuterRef('pk')}
+            ).order_by().values(relation).annotate(
+                count=Count('pk')
+            ).values('count')
+        ),
+        0
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает денормализованные счётчики рецептов и пользователей '
+        'и исправляет расхождения'
+    )
+
+    def handle(self, *args, **options):
+        for source, relation, target, field in COUNTERS:
+            actual = count_subquery(source, relation)
+            with transaction.atomic():
+                drifted = target.objects.annotate(
+                    actual=actual
+                ).exclude(**{field: F('actual')}).values('pk')
+                # Переписываем только разошедшиеся строки
+                fixed = target.objects.filter(pk__in=drifted).update(
+                    **{field: actual}
+                )
+
+            self.stdout.write(
+                f'{target.__name__}.{field}: исправлено строк — {fixed}'
+            )
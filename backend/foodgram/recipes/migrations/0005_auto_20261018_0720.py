@@ -0,0 +1,27 @@
+# Generated by Django 2.2.16 on 2026-10-18 07:20
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_auto_20261018_0614'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        # Поиск по началу названия: UPPER(name) LIKE 'ЗАПРОС%'
+        migrations.RunSQL(
+            'CREATE INDEX recipes_ingredient_name_prefix '
+            'ON recipes_ingredient (UPPER(name::text) text_pattern_ops);',
+            'DROP INDEX recipes_ingredient_name_prefix;'
+        ),
+        # Поиск по подстроке и похожим названиям (LIKE '%ЗАПРОС%' и %)
+        migrations.RunSQL(
+            'CREATE INDEX recipes_ingredient_name_trgm '
+            'ON recipes_ingredient USING gin (UPPER(name::text) gin_trgm_ops);',
+            'DROP INDEX recipes_ingredient_name_trgm;'
+        ),
+    ]
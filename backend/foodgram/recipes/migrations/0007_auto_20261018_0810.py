@@ -0,0 +1,50 @@
+# Generated by Django 2.2.16 on 2026-10-18 08:10
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+# Каждая связь рецепт — количество из автоматической таблицы
+# recipes_recipe_ingredients переносится в поле recipe. Если одну строку
+# количества использовали несколько рецептов, для остальных создаются копии,
+# а из повторов одного ингредиента в рецепте остаётся самый новый
+FOLD_LINKS_SQL = '''
+UPDATE recipes_ingredientamount AS amount
+SET recipe_id = link.recipe_id
+FROM (
+    SELECT DISTINCT ON (ingredientamount_id) ingredientamount_id, recipe_id
+    FROM recipes_recipe_ingredients
+    ORDER BY ingredientamount_id, recipe_id
+) AS link
+WHERE amount.primary_key = link.ingredientamount_id;
+
+INSERT INTO recipes_ingredientamount (ingredient_id, amount, recipe_id)
+SELECT amount.ingredient_id, amount.amount, link.recipe_id
+FROM recipes_recipe_ingredients AS link
+JOIN recipes_ingredientamount AS amount
+    ON amount.primary_key = link.ingredientamount_id
+WHERE amount.recipe_id <> link.recipe_id;
+
+DELETE FROM recipes_ingredientamount AS amount
+USING recipes_ingredientamount AS newer
+WHERE amount.recipe_id = newer.recipe_id
+    AND amount.ingredient_id = newer.ingredient_id
+    AND amount.primary_key < newer.primary_key;
+
+SET CONSTRAINTS ALL IMMEDIATE;
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_auto_20261018_0745'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredientamount',
+            name='recipe',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_amounts', to='recipes.Recipe', verbose_name='recipe'),
+        ),
+        migrations.RunSQL(FOLD_LINKS_SQL, migrations.RunSQL.noop),
+    ]
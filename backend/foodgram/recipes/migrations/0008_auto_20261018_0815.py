@@ -0,0 +1,39 @@
+# Generated by Django 2.2.16 on 2026-10-18 08:15
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_auto_20261018_0810'),
+    ]
+
+    operations = [
+        # Строки без рецепта остались от старых обновлений рецептов.
+        # После этой миграции их не бывает: recipe обязателен, CASCADE
+        migrations.RunSQL(
+            'DELETE FROM recipes_ingredientamount WHERE recipe_id IS NULL;'
+            'SET CONSTRAINTS ALL IMMEDIATE;',
+            migrations.RunSQL.noop
+        ),
+        migrations.AlterField(
+            model_name='ingredientamount',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_amounts', to='recipes.Recipe', verbose_name='recipe'),
+        ),
+        migrations.RemoveField(
+            model_name='recipe',
+            name='ingredients',
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredients',
+            field=models.ManyToManyField(related_name='recipes', through='recipes.IngredientAmount', to='recipes.Ingredient', verbose_name='ingredients'),
+        ),
+        migrations.AddConstraint(
+            model_name='ingredientamount',
+            constraint=models.UniqueConstraint(fields=('recipe', 'ingredient'), name='unique recipe ingredient'),
+        ),
+    ]
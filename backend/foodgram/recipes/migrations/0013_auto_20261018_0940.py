@@ -0,0 +1,31 @@
+# Generated by Django 2.2.16 on 2026-10-18 09:40
+
+import django.contrib.postgres.fields
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_auto_20261018_0920'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='ingredient_ids',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.IntegerField(), default=list, editable=False, size=None, verbose_name='ingredient ids'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['ingredient_ids'], name='recipe_ingredient_ids'),
+        ),
+        # id ингредиентов для уже существующих рецептов
+        migrations.RunSQL(
+            'UPDATE recipes_recipe AS recipe SET ingredient_ids = ARRAY('
+            'SELECT amount.ingredient_id FROM recipes_ingredientamount '
+            'AS amount WHERE amount.recipe_id = recipe.id);',
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.16 on 2026-10-18 10:00
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_timelines(apps, schema_editor):
+    """Ленты для уже существующих подписок, кроме популярных авторов"""
+    schema_editor.execute(
+        'INSERT INTO recipes_timelineentry (user_id, recipe_id) '
+        'SELECT subscription.user_id, recipe.id '
+        'FROM users_subscription AS subscription '
+        'JOIN users_user AS author ON author.id = subscription.author_id '
+        'JOIN recipes_recipe AS recipe ON recipe.author_id = author.id '
+        'WHERE author.followers_count <= %s',
+        [settings.FEED_FANOUT_MAX_FOLLOWERS]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0013_auto_20261018_0940'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TimelineEntry',
+            fields=[
+                ('primary_key', models.AutoField(primary_key=True, serialize=False, verbose_name='primary key')),
+                ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline_entries', to='recipes.Recipe', verbose_name='recipe')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='timeline', to=settings.AUTH_USER_MODEL, verbose_name='user')),
+            ],
+            options={
+                'verbose_name': 'Timeline entry',
+                'verbose_name_plural': 'Timeline entries',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='timelineentry',
+            constraint=models.UniqueConstraint(fields=('user', 'recipe'), name='unique timeline entry'),
+        ),
+        migrations.RunPython(fill_timelines, migrations.RunPython.noop),
+    ]
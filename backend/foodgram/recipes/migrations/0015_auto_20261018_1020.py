@@ -0,0 +1,35 @@
+# Generated by Django 2.2.16 on 2026-10-18 10:20
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def fill_popularity(apps, schema_editor):
+    # Времени старых событий нет, стартуем с накопленных счётчиков
+    Recipe = apps.get_model('recipes', 'Recipe')
+    weights = settings.POPULARITY_WEIGHTS
+    Recipe.objects.update(
+        popularity=F('favourites_count') * weights['Favourite']
+        + F('in_cart_count') * weights['ShoppingCart']
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_auto_20261018_1000'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='popularity',
+            field=models.FloatField(default=0, editable=False, verbose_name='popularity'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['-popularity', '-id'], name='recipe_popularity'),
+        ),
+        migrations.RunPython(fill_popularity, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.16 on 2026-10-18 11:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0017_auto_20261018_1100'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PopularityDecay',
+            fields=[
+                ('primary_key', models.AutoField(primary_key=True, serialize=False, verbose_name='primary key')),
+                ('decayed_at', models.DateTimeField(verbose_name='decayed at')),
+            ],
+            options={
+                'verbose_name': 'Popularity decay',
+                'verbose_name_plural': 'Popularity decays',
+            },
+        ),
+    ]
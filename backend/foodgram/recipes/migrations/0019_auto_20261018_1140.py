@@ -0,0 +1,18 @@
+# Generated by Django 2.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0018_auto_20261018_1120'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='fragment_revision',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='fragment revision'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 2.2.16 on 2026-10-18 12:00
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0019_auto_20261018_1140'),
+    ]
+
+    operations = [
+        # text_pattern_ops годится для LIKE, но не для ORDER BY: подсказки
+        # сортировали все совпадения. В COLLATE "C" обычный btree
+        # отвечает и за UPPER(name) LIKE 'ЗАПРОС%', и за порядок
+        migrations.RunSQL(
+            'DROP INDEX recipes_ingredient_name_prefix;'
+            'CREATE INDEX recipes_ingredient_name_prefix '
+            'ON recipes_ingredient ((UPPER(name::text) COLLATE "C"));',
+            'DROP INDEX recipes_ingredient_name_prefix;'
+            'CREATE INDEX recipes_ingredient_name_prefix '
+            'ON recipes_ingredient (UPPER(name::text) text_pattern_ops);'
+        ),
+    ]
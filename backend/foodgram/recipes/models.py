@@ -1,7 +1,79 @@
+from django.conf import settings
+from django.contrib.postgres.aggregates import StringAgg
+from django.contrib.postgres.fields import ArrayField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (SearchQuery, SearchRank,
+                                            SearchVector, SearchVectorField,
+                                            TrigramDistance)
 from django.db import models
+from django.db.models import (Exists, ExpressionWrapper, F, FloatField, Func,
+                              IntegerField, OuterRef, Prefetch, Subquery, Sum,
+                              Value)
+from django.db.models.functions import Cast, Upper
 
 from api.validators import hex_code_validator
-from users.models import User
+from recipes.storage import ContentAddressedStorage
+from users.models import Subscription, User
+
+recipe_images_storage = ContentAddressedStorage()
+
+# Конфигурация полнотекстового поиска Postgres: рецепты на русском
+SEARCH_CONFIG = 'russian'
+
+
+class UpperBytes(Func):
+    """
+    UPPER() в побайтовом порядке (COLLATE "C"): один индекс из миграции
+    0020 отвечает и за поиск по началу строки, и за сортировку
+    """
+    function = 'UPPER'
+    template = '(%(function)s(%(expressions)s) COLLATE "C")'
+    output_field = models.CharField()
+
+
+class IngredientQuerySet(models.QuerySet):
+    # Короче трёх символов триграммы не помогают, ищем только по началу
+    TRIGRAM_MIN_LENGTH = 3
+
+    def autocomplete(self, query, limit):
+        """
+        Подсказки для формы рецепта: сначала совпадения по началу названия,
+        затем по подстроке, затем похожие (pg_trgm). У каждой группы свой
+        LIMIT, поэтому ни одна не сортирует все найденные строки
+        """
+        query = query.upper()
+        queryset = self.annotate(sort_name=UpperBytes('name'))
+        prefix = queryset.filter(sort_name__startswith=query)
+
+        if len(query) < self.TRIGRAM_MIN_LENGTH:
+            return prefix.order_by('sort_name')[:limit]
+
+        # Подстрока и похожие названия ищутся по триграммному индексу
+        # над UPPER(name) без COLLATE, как он объявлен в миграции 0005
+        queryset = queryset.annotate(upper_name=Upper('name'))
+        no_distance = Value(0, output_field=FloatField())
+        groups = (
+            prefix.annotate(
+                upper_name=Upper('name'), distance=no_distance
+            ).order_by('sort_name'),
+            queryset.filter(upper_name__contains=query).exclude(
+                sort_name__startswith=query
+            ).annotate(distance=no_distance).order_by('sort_name'),
+            queryset.filter(upper_name__trigram_similar=query).exclude(
+                upper_name__contains=query
+            ).annotate(
+                distance=TrigramDistance('upper_name', query)
+            ).order_by('distance', 'sort_name'),
+        )
+        groups = [
+            group.annotate(rank=Value(rank, output_field=IntegerField()))[
+                :limit
+            ]
+            for rank, group in enumerate(groups)
+        ]
+        return groups[0].union(*groups[1:], all=True).order_by(
+            'rank', 'distance', 'sort_name'
+        )[:limit]
 
 
 class Ingredient(models.Model):
@@ -10,15 +82,43 @@ class Ingredient(models.Model):
         max_length=150, verbose_name='measurement unit'
     )
 
+    objects = IngredientQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ingredient'
         verbose_name_plural = 'Ingredients'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique ingredient'
+            )
+        ]
+
+
+class IngredientAmountQuerySet(models.QuerySet):
+    def shopping_list(self, user):
+        """Суммы ингредиентов по всем рецептам в списке покупок user"""
+        return self.filter(recipe__recipes_in_cart__user=user).values(
+            name=F('ingredient__name'),
+            measurement_unit=F('ingredient__measurement_unit')
+        ).annotate(
+            total_amount=Sum('amount')
+        ).order_by('name', 'measurement_unit')
 
 
 class IngredientAmount(models.Model):
+    """Промежуточная таблица рецепт — ингредиент с количеством"""
     primary_key = models.AutoField(
         primary_key=True, verbose_name='primary key'
     )
+    # Поиск по рецепту обслуживает ingredient_amount_covering
+    recipe = models.ForeignKey(
+        'Recipe',
+        on_delete=models.CASCADE,
+        related_name='ingredient_amounts',
+        db_index=False,
+        verbose_name='recipe'
+    )
     ingredient = models.ForeignKey(
         Ingredient,
         on_delete=models.CASCADE,
@@ -27,9 +127,24 @@ class IngredientAmount(models.Model):
     )
     amount = models.PositiveIntegerField(verbose_name='amount')
 
+    objects = IngredientAmountQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ingredient amount'
         verbose_name_plural = 'Ingredient amounts'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'ingredient'],
+                name='unique recipe ingredient'
+            )
+        ]
+        indexes = [
+            # Сумма по списку покупок читается из индекса, без таблицы
+            models.Index(
+                fields=['recipe', 'ingredient', 'amount'],
+                name='ingredient_amount_covering'
+            ),
+        ]
 
 
 class Tag(models.Model):
@@ -44,36 +159,267 @@ class Tag(models.Model):
         verbose_name_plural = 'Tags'
 
 
+class ArraySubquery(Subquery):
+    """Столбец подзапроса в виде массива: ARRAY(SELECT ...)"""
+    template = 'ARRAY(%(subquery)s)'
+    output_field = ArrayField(IntegerField())
+
+
+class CountInArray(Func):
+    """Сколько элементов массива-столбца входит в переданный список"""
+    template = (
+        '(SELECT count(*) FROM unnest(%(column)s) AS item '
+        'WHERE item = ANY(%(values)s))'
+    )
+    output_field = IntegerField()
+
+    def __init__(self, column, values):
+        super().__init__(F(column), Value(
+            values, output_field=ArrayField(IntegerField())
+        ))
+
+    def as_sql(self, compiler, connection, **extra_context):
+        column_sql, column_params = compiler.compile(
+            self.source_expressions[0]
+        )
+        values_sql, values_params = compiler.compile(
+            self.source_expressions[1]
+        )
+        sql = self.template % {'column': column_sql, 'values': values_sql}
+        return sql, (*column_params, *values_params)
+
+
+class RecipeQuerySet(models.QuerySet):
+    def with_related(self, user=None):
+        """
+        Подгружает автора, тэги и ингредиенты фиксированным числом запросов,
+        независимо от количества рецептов
+        """
+        authors = User.objects.all()
+        if user is not None and user.is_authenticated:
+            authors = authors.annotate(
+                is_subscribed=Exists(Subscription.objects.filter(
+                    user=user, author=OuterRef('pk')
+                ))
+            )
+
+        return self.prefetch_related(
+            Prefetch('author', queryset=authors),
+            'tags',
+            Prefetch(
+                'ingredient_amounts',
+                queryset=IngredientAmount.objects.select_related(
+                    'ingredient'
+                ).order_by('primary_key')
+            )
+        )
+
+    def with_user_flags(self, user):
+        """
+        Флаги is_favorited и is_in_shopping_cart для текущего пользователя
+        """
+        if user.is_anonymous:
+            return self
+
+        return self.annotate(
+            is_favorited=Exists(Favourite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            ))
+        )
+
+    def latest_per_author(self, limit=None):
+        """
+        Последние limit рецептов каждого автора одним запросом: коррелированный
+        подзапрос с LIMIT отбирает id рецептов для каждой строки
+        """
+        queryset = self.order_by('-id')
+        if limit is None:
+            return queryset
+
+        latest = Recipe.objects.filter(
+            author=OuterRef('author')
+        ).order_by('-id').values('pk')[:limit]
+        return queryset.filter(pk__in=Subquery(latest))
+
+    def update_search_index(self):
+        """
+        Пересобирает поисковый вектор и список id ингредиентов.
+        В векторе название важнее ингредиентов, ингредиенты важнее текста
+        """
+        ingredient_names = Subquery(IngredientAmount.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('recipe').annotate(
+            names=StringAgg('ingredient__name', ' ')
+        ).values('names'), output_field=models.TextField())
+        ingredient_ids = IngredientAmount.objects.filter(
+            recipe=OuterRef('pk')
+        ).values('ingredient_id')
+        return self.update(
+            search_vector=(
+                SearchVector('name', weight='A', config=SEARCH_CONFIG)
+                + SearchVector(
+                    ingredient_names, weight='B', config=SEARCH_CONFIG
+                )
+                + SearchVector('text', weight='C', config=SEARCH_CONFIG)
+            ),
+            ingredient_ids=ArraySubquery(ingredient_ids)
+        )
+
+    def search(self, query):
+        """Рецепты, подходящие под запрос, от более релевантных"""
+        search_query = SearchQuery(query, config=SEARCH_CONFIG)
+        return self.filter(search_vector=search_query).annotate(
+            rank=SearchRank(F('search_vector'), search_query)
+        ).order_by('-rank', '-id')
+
+    def feed(self, user):
+        """
+        Рецепты авторов, на которых подписан user: из материализованной
+        ленты и, для популярных авторов, напрямую по индексу
+        (author, -id). Один запрос при любом числе подписок
+        """
+        timeline = TimelineEntry.objects.filter(user=user).values('recipe')
+        popular_authors = Subscription.objects.filter(
+            user=user,
+            author__followers_count__gt=settings.FEED_FANOUT_MAX_FOLLOWERS
+        ).values('author')
+        popular = Recipe.objects.filter(
+            author__in=popular_authors
+        ).values('pk')
+        # Отписка чистит ленту в фоне, до этого её записи отсекает
+        # проверка подписки
+        return self.filter(
+            pk__in=timeline.union(popular, all=True),
+            author__in=Subscription.objects.filter(
+                user=user
+            ).values('author')
+        )
+
+    def popular(self):
+        return self.order_by('-popularity', '-id')
+
+    def cookable_with(self, ingredient_ids):
+        """
+        Рецепты, в которых есть хотя бы один из ингредиентов, от большей
+        доли имеющихся ингредиентов к меньшей. Отбор идёт по GIN-индексу
+        на ingredient_ids
+        """
+        ingredient_ids = sorted(ingredient_ids)
+        return self.filter(ingredient_ids__overlap=ingredient_ids).annotate(
+            matched_count=CountInArray('ingredient_ids', ingredient_ids)
+        ).annotate(
+            coverage=ExpressionWrapper(
+                Cast('matched_count', FloatField())
+                / Func('ingredient_ids', function='cardinality'),
+                output_field=FloatField()
+            )
+        ).order_by('-coverage', '-matched_count', '-id')
+
+
 class Recipe(models.Model):
     ingredients = models.ManyToManyField(
-        IngredientAmount, verbose_name='ingredients'
+        Ingredient,
+        through=IngredientAmount,
+        related_name='recipes',
+        verbose_name='ingredients'
     )
     tags = models.ManyToManyField(Tag, verbose_name='tags')
     image = models.ImageField(
-        upload_to='recipes/images/', verbose_name='image'
+        upload_to='recipes/images/', storage=recipe_images_storage,
+        verbose_name='image'
+    )
+    # Уменьшенная копия и WebP-версия картинки. Заполняются в фоне
+    # (recipes/tasks.py), до этого поля пустые
+    thumbnail = models.ImageField(
+        upload_to='recipes/thumbnails/', storage=recipe_images_storage,
+        blank=True, verbose_name='thumbnail'
+    )
+    image_webp = models.ImageField(
+        upload_to='recipes/webp/', storage=recipe_images_storage,
+        blank=True, verbose_name='image webp'
     )
     name = models.CharField(max_length=200, verbose_name='name')
     text = models.TextField(verbose_name='text')
     cooking_time = models.PositiveSmallIntegerField(
         verbose_name='cooking time'
     )
+    # Поиск по автору обслуживает recipe_author_latest
     author = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
         related_name='author',
+        db_index=False,
         verbose_name='author'
     )
 
-    @property
-    def favourites_count(self):
-        """
-        Дополнительное поле для админки
-        """
-        return Favourite.objects.filter(recipe=self.id).count()
+    # Счётчики обновляются сигналами (recipes/signals.py), расхождения
+    # исправляет команда reconcile_counters
+    favourites_count = models.PositiveIntegerField(
+        default=0, verbose_name='favourites count'
+    )
+    in_cart_count = models.PositiveIntegerField(
+        default=0, verbose_name='in cart count'
+    )
+    # Затухающая популярность: растёт при добавлении в избранное и список
+    # покупок (recipes/signals.py), уменьшается командой decay_popularity
+    popularity = models.FloatField(
+        default=0, editable=False, verbose_name='popularity'
+    )
+    # Растёт при каждом изменении, которое видно в ответе с рецептом;
+    # входит в ключ закэшированного фрагмента (api/cache.py). Меняется
+    # только через F('fragment_revision') + 1, см. save
+    fragment_revision = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name='fragment revision'
+    )
+    # Название, ингредиенты и текст для полнотекстового поиска и id
+    # ингредиентов для поиска по имеющимся продуктам (обратный индекс
+    # ингредиент -> рецепты через GIN). Обновляются
+    # RecipeQuerySet.update_search_index после сохранения
+    search_vector = SearchVectorField(null=True, editable=False)
+    ingredient_ids = ArrayField(
+        models.IntegerField(), default=list, editable=False,
+        verbose_name='ingredient ids'
+    )
+
+    objects = RecipeQuerySet.as_manager()
 
     class Meta:
         verbose_name = 'Recipe'
         verbose_name_plural = 'Recipes'
+        indexes = [
+            # Рецепты автора от новых к старым: фильтр author,
+            # latest_per_author и счётчики
+            models.Index(
+                fields=['author', '-id'], name='recipe_author_latest'
+            ),
+            GinIndex(fields=['search_vector'], name='recipe_search_vector'),
+            GinIndex(fields=['ingredient_ids'], name='recipe_ingredient_ids'),
+            models.Index(
+                fields=['-popularity', '-id'], name='recipe_popularity'
+            ),
+        ]
+
+    # Меняются только через update() и F(): полное сохранение
+    # отредактированного рецепта затёрло бы их значениями из памяти
+    UPDATED_SEPARATELY = (
+        'favourites_count', 'in_cart_count', 'popularity', 'thumbnail',
+        'image_webp', 'search_vector', 'ingredient_ids', 'fragment_revision'
+    )
+
+    def save(self, force_insert=False, force_update=False, using=None,
+             update_fields=None):
+        if not self._state.adding and update_fields is None:
+            deferred = self.get_deferred_fields()
+            update_fields = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in self.UPDATED_SEPARATELY
+                and field.attname not in deferred
+            ]
+        super().save(force_insert, force_update, using, update_fields)
 
 
 class Favourite(models.Model):
@@ -130,3 +476,91 @@ class ShoppingCart(models.Model):
                 name='unique cart item'
             )
         ]
+
+
+class TimelineEntry(models.Model):
+    """
+    Материализованная лента: рецепт автора, на которого подписан user.
+    Заполняется при публикации рецепта (recipes/tasks.py), для популярных
+    авторов не заполняется — их рецепты читаются в момент запроса
+    """
+    primary_key = models.AutoField(
+        primary_key=True, verbose_name='primary key'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='user'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='recipe'
+    )
+
+    class Meta:
+        verbose_name = 'Timeline entry'
+        verbose_name_plural = 'Timeline entries'
+        constraints = [
+            # Заодно индекс для ленты: записи пользователя по id рецепта
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='unique timeline entry'
+            )
+        ]
+
+
+class SimilarRecipe(models.Model):
+    """
+    Топ-K похожих рецептов: по совместному добавлению в избранное
+    и общим ингредиентам. Строится командой build_similar_recipes
+    """
+    primary_key = models.AutoField(
+        primary_key=True, verbose_name='primary key'
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar',
+        verbose_name='recipe'
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='similar recipe'
+    )
+    score = models.FloatField(verbose_name='score')
+
+    class Meta:
+        verbose_name = 'Similar recipe'
+        verbose_name_plural = 'Similar recipes'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'similar'],
+                name='unique similar recipe'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['recipe', '-score'], name='similar_recipe_top'
+            ),
+        ]
+
+
+class PopularityDecay(models.Model):
+    """
+    Единственная строка: когда команда decay_popularity в последний раз
+    уменьшала популярность. Хранится в БД, а не в кэше, чтобы отметка
+    не терялась при очистке кэша
+    """
+    primary_key = models.AutoField(
+        primary_key=True, verbose_name='primary key'
+    )
+    decayed_at = models.DateTimeField(verbose_name='decayed at')
+
+    class Meta:
+        verbose_name = 'Popularity decay'
+        verbose_name_plural = 'Popularity decays'
@@ -0,0 +1,106 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save
+
+from recipes.models import Favourite, Ingredient, Recipe, ShoppingCart
+from recipes.tasks import (clear_timeline, fan_out_recipe, fill_timeline,
+                           schedule_fan_out)
+from users.models import Subscription, User
+
+# (модель-источник, поле связи, модель со счётчиком, поле счётчика)
+COUNTERS = (
+    (Favourite, 'recipe', Recipe, 'favourites_count'),
+    (ShoppingCart, 'recipe', Recipe, 'in_cart_count'),
+    (Recipe, 'author', User, 'recipes_count'),
+    (Subscription, 'author', User, 'followers_count'),
+)
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно меняет счётчик на стороне БД, не опускаясь ниже нуля"""
+    model.objects.filter(pk=pk).update(
+        **{field: Greatest(F(field) + delta, 0)}
+    )
+
+
+def connect_counters():
+    for source, relation, target, field in COUNTERS:
+        def increment(sender, instance, created, relation=relation,
+                      target=target, field=field, **kwargs):
+            if created:
+                pk = getattr(instance, f'{relation}_id')
+                change_counter(target, pk, field, 1)
+
+        def decrement(sender, instance, relation=relation, target=target,
+                      field=field, **kwargs):
+            pk = getattr(instance, f'{relation}_id')
+            change_counter(target, pk, field, -1)
+
+        post_save.connect(
+            increment, sender=source, weak=False,
+            dispatch_uid=f'{source.__name__}_{field}_increment'
+        )
+        post_delete.connect(
+            decrement, sender=source, weak=False,
+            dispatch_uid=f'{source.__name__}_{field}_decrement'
+        )
+
+
+def update_search_vectors(sender, instance, created, **kwargs):
+    """Название ингредиента входит в поисковый вектор его рецептов"""
+    if not created:
+        Recipe.objects.filter(ingredients=instance).update_search_index()
+
+
+def connect_search_vectors():
+    post_save.connect(
+        update_search_vectors, sender=Ingredient,
+        dispatch_uid='Ingredient_search_vectors'
+    )
+
+
+def fan_out_new_recipe(sender, instance, created, **kwargs):
+    if created:
+        schedule_fan_out(fan_out_recipe, instance.pk)
+
+
+def fill_timeline_on_subscribe(sender, instance, created, **kwargs):
+    if created:
+        schedule_fan_out(fill_timeline, instance.user_id, instance.author_id)
+
+
+def clear_timeline_on_unsubscribe(sender, instance, **kwargs):
+    schedule_fan_out(clear_timeline, instance.user_id, instance.author_id)
+
+
+def connect_timelines():
+    post_save.connect(
+        fan_out_new_recipe, sender=Recipe,
+        dispatch_uid='Recipe_timeline_fan_out'
+    )
+    post_save.connect(
+        fill_timeline_on_subscribe, sender=Subscription,
+        dispatch_uid='Subscription_timeline_fill'
+    )
+    post_delete.connect(
+        clear_timeline_on_unsubscribe, sender=Subscription,
+        dispatch_uid='Subscription_timeline_clear'
+    )
+
+
+def bump_popularity(sender, instance, created, **kwargs):
+    """Добавление в избранное или список покупок поднимает рецепт"""
+    if created:
+        Recipe.objects.filter(pk=instance.recipe_id).update(
+            popularity=F('popularity')
+            + settings.POPULARITY_WEIGHTS[sender.__name__]
+        )
+
+
+def connect_popularity():
+    for model in (Favourite, ShoppingCart):
+        post_save.connect(
+            bump_popularity, sender=model,
+            dispatch_uid=f'{model.__name__}_popularity'
+        )
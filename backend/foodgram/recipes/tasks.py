@@ -0,0 +1,241 @@
+import io
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from django.db.models import F
+from django.utils.module_loading import import_string
+from PIL import Image
+
+from api.cache import RECIPES_TAG, invalidate_tags
+from recipes.models import Recipe, TimelineEntry
+from users.models import Subscription, User
+
+logger = logging.getLogger(__name__)
+
+
+def run_task(task, *args):
+    try:
+        task(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s упала', task.__name__)
+
+
+def run_in_thread(task, *args):
+    try:
+        run_task(task, *args)
+    finally:
+        # У каждого потока своё соединение с БД, закрываем его за собой
+        connections.close_all()
+
+
+class SyncBroker:
+    """Выполняет задачу сразу, в текущем потоке. Для отладки"""
+    def __init__(self, name, workers, queue_size):
+        pass
+
+    def enqueue(self, task, *args):
+        run_task(task, *args)
+
+
+class ThreadPoolBroker:
+    """
+    Локальная очередь: пул потоков внутри воркера gunicorn. Очередь
+    ограничена, при переполнении задача выполняется в текущем потоке.
+    При перезапуске воркера очередь теряется, поэтому у каждой задачи
+    есть команда, которая доделывает пропущенное
+    """
+    def __init__(self, name, workers, queue_size):
+        self.name = name
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix=name
+        )
+        # Выполняемые задачи плюс ожидающие в очереди
+        self.slots = threading.BoundedSemaphore(workers + queue_size)
+
+    def release(self, future):
+        self.slots.release()
+
+    def enqueue(self, task, *args):
+        if not self.slots.acquire(blocking=False):
+            logger.warning(
+                'Очередь %s заполнена, задача %s выполняется сразу',
+                self.name, task.__name__
+            )
+            run_task(task, *args)
+            return
+        self.executor.submit(run_in_thread, task, *args).add_done_callback(
+            self.release
+        )
+
+
+# Очереди задач: имя — префикс настроек <имя>_BROKER, <имя>_WORKERS
+# и <имя>_QUEUE_SIZE
+IMAGES_QUEUE = 'IMAGE_PROCESSING'
+FEED_QUEUE = 'FEED_FANOUT'
+
+_brokers = {}
+
+
+def get_broker(queue):
+    """
+    Брокер очереди задаётся настройкой <очередь>_BROKER — путь к классу
+    с методом enqueue(task, *args). Создаётся один раз на процесс,
+    уже после форка воркера
+    """
+    if queue not in _brokers:
+        _brokers[queue] = import_string(getattr(settings, f'{queue}_BROKER'))(
+            name=queue.lower(),
+            workers=getattr(settings, f'{queue}_WORKERS'),
+            queue_size=getattr(settings, f'{queue}_QUEUE_SIZE'),
+        )
+    return _brokers[queue]
+
+
+def encode_webp(image):
+    buffer = io.BytesIO()
+    image.save(buffer, 'WEBP', quality=settings.IMAGE_WEBP_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def process_recipe_image(recipe_id):
+    """Делает уменьшенную копию и WebP-версию картинки рецепта"""
+    recipe = Recipe.objects.filter(pk=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return
+    source = recipe.image.name
+
+    with recipe.image.open('rb') as file, Image.open(file) as image:
+        image = image.convert('RGBA' if 'A' in image.getbands()
+                              or image.mode == 'P' else 'RGB')
+        full = encode_webp(image)
+        image.thumbnail(settings.RECIPE_THUMBNAIL_SIZE)
+        small = encode_webp(image)
+
+    # Имена по хэшу содержимого задаст хранилище
+    recipe.image_webp.save('image.webp', full, save=False)
+    recipe.thumbnail.save('thumbnail.webp', small, save=False)
+    # Пока картинка обрабатывалась, её могли заменить: тогда не трогаем
+    # update() не шлёт сигналов, а миниатюра попадает в ответы:
+    # ревизию фрагмента меняем сами
+    updated = Recipe.objects.filter(pk=recipe_id, image=source).update(
+        thumbnail=recipe.thumbnail.name, image_webp=recipe.image_webp.name,
+        fragment_revision=F('fragment_revision') + 1
+    )
+    if updated:
+        invalidate_tags(RECIPES_TAG)
+
+
+def schedule(task, *args, queue=IMAGES_QUEUE):
+    """Ставит задачу в очередь после коммита транзакции"""
+    transaction.on_commit(lambda: get_broker(queue).enqueue(task, *args))
+
+
+def schedule_image_processing(recipe):
+    schedule(process_recipe_image, recipe.pk)
+
+
+def schedule_fan_out(task, *args):
+    schedule(task, *args, queue=FEED_QUEUE)
+
+
+def is_popular(author):
+    """Рецепты популярных авторов читаются при запросе ленты"""
+    return author.followers_count > settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def add_to_timelines(entries):
+    """entries — пары (user_id, recipe_id), пишутся пачками"""
+    entries = iter(entries)
+    while True:
+        batch = list(islice(entries, settings.FEED_FANOUT_BATCH_SIZE))
+        if not batch:
+            break
+        TimelineEntry.objects.bulk_create(
+            [
+                TimelineEntry(user_id=user_id, recipe_id=recipe_id)
+                for user_id, recipe_id in batch
+            ],
+            ignore_conflicts=True
+        )
+
+
+def fan_out_recipe(recipe_id):
+    """Раскладывает новый рецепт по лентам подписчиков автора"""
+    recipe = Recipe.objects.select_related('author').filter(
+        pk=recipe_id
+    ).first()
+    if recipe is None or is_popular(recipe.author):
+        return
+
+    followers = Subscription.objects.filter(
+        author=recipe.author_id
+    ).values_list('user_id', flat=True)
+    add_to_timelines(
+        (user_id, recipe_id) for user_id in followers.iterator()
+    )
+
+
+def fill_timeline(user_id, author_id):
+    """После подписки добавляет в ленту уже опубликованные рецепты"""
+    author = User.objects.filter(pk=author_id).first()
+    if author is None or is_popular(author):
+        return
+
+    recipes = Recipe.objects.filter(
+        author=author_id
+    ).values_list('pk', flat=True)
+    add_to_timelines(
+        (user_id, recipe_id) for recipe_id in recipes.iterator()
+    )
+
+
+def clear_timeline(user_id, author_id):
+    """После отписки убирает рецепты автора из ленты"""
+    TimelineEntry.objects.filter(
+        user=user_id, recipe__author=author_id
+    ).delete()
+    # Автор только что перестал быть популярным: его рецепты больше
+    # не читаются при запросе ленты, раскладываем их подписчикам
+    author = User.objects.filter(pk=author_id).first()
+    if (author is not None and author.followers_count
+            == settings.FEED_FANOUT_MAX_FOLLOWERS):
+        backfill_author(author_id)
+
+
+def backfill_author(author_id):
+    """Раскладывает все рецепты автора по лентам всех его подписчиков"""
+    followers = Subscription.objects.filter(
+        author=author_id
+    ).values_list('user_id', flat=True)
+    recipes = list(
+        Recipe.objects.filter(author=author_id).values_list('pk', flat=True)
+    )
+    add_to_timelines(
+        (user_id, recipe_id)
+        for user_id in followers.iterator()
+        for recipe_id in recipes
+    )
+
+
+def rebuild_timeline(user_id):
+    """
+    Собирает ленту заново по текущим подпискам: после задач, потерянных
+    при перезапуске, и после смены популярности авторов
+    """
+    authors = Subscription.objects.filter(
+        user=user_id,
+        author__followers_count__lte=settings.FEED_FANOUT_MAX_FOLLOWERS
+    ).values('author')
+    recipes = Recipe.objects.filter(
+        author__in=authors
+    ).values_list('pk', flat=True)
+    with transaction.atomic():
+        TimelineEntry.objects.filter(user=user_id).delete()
+        add_to_timelines(
+            (user_id, recipe_id) for recipe_id in recipes.iterator()
+        )
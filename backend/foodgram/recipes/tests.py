@@ -0,0 +1,329 @@
+import threading
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .management.commands.load_ingredients import read_csv, read_json
+from .models import (Favourite, Ingredient, IngredientAmount,
+                     PopularityDecay, Recipe, ShoppingCart, SimilarRecipe,
+                     Tag, TimelineEntry)
+from .tasks import ThreadPoolBroker, clear_timeline
+from users.models import Subscription, User
+
+
+class QueryPlanTests(TestCase):
+    """Частые запросы API используют индексы из 0011 и users.0006"""
+    recipes_count = 3000
+    authors_count = 50
+    tags_count = 300
+    ingredients_count = 300
+
+    @classmethod
+    def setUpTestData(cls):
+        # Пропорции как у живой базы: авторов и тэгов много,
+        # у рецепта пара тэгов и несколько ингредиентов
+        cls.user = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass',
+            first_name='Reader', last_name='Reader'
+        )
+        authors = User.objects.bulk_create(
+            User(
+                username=f'author{i}', email=f'author{i}@example.com',
+                first_name='Author', last_name=str(i)
+            )
+            for i in range(cls.authors_count)
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'tag{i}', color='#ffffff', slug=f'tag{i}')
+            for i in range(cls.tags_count)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient{i}', measurement_unit='г')
+            for i in range(cls.ingredients_count)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=authors[i % cls.authors_count], name=f'recipe{i}',
+                text='text', cooking_time=10,
+                image='recipes/images/recipe.png'
+            )
+            for i in range(cls.recipes_count)
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(
+                recipe=recipe,
+                tag=tags[(i * 7 + k) % cls.tags_count]
+            )
+            for i, recipe in enumerate(recipes)
+            for k in range(2)
+        )
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
+                recipe=recipe,
+                ingredient=ingredients[
+                    (i * 13 + k * 31) % cls.ingredients_count
+                ],
+                amount=10 + k
+            )
+            for i, recipe in enumerate(recipes)
+            for k in range(6)
+        )
+        Favourite.objects.bulk_create(
+            Favourite(user=cls.user, recipe=recipe)
+            for recipe in recipes[::50]
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe)
+            for recipe in recipes[::300]
+        )
+        Subscription.objects.bulk_create(
+            Subscription(user=cls.user, author=author)
+            for author in authors[:5]
+        )
+        Recipe.objects.update_search_index()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def test_queries_use_expected_indexes(self):
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertNotIn('не использует', out.getvalue())
+
+
+class IngredientAutocompleteTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in (
+                'salt flakes', 'sugar', 'sea salt', 'sale', 'soda', 'salt'
+            )
+        )
+
+    def names(self, query, limit=10):
+        return [
+            ingredient.name
+            for ingredient in Ingredient.objects.autocomplete(query, limit)
+        ]
+
+    def test_prefix_then_substring_then_similar(self):
+        self.assertEqual(
+            self.names('Salt'), ['salt', 'salt flakes', 'sea salt', 'sale']
+        )
+        self.assertEqual(self.names('salt', limit=2), ['salt', 'salt flakes'])
+
+    def test_short_query_matches_prefix_only(self):
+        self.assertEqual(self.names('sa'), ['sale', 'salt', 'salt flakes'])
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.reader, cls.other, cls.author = [
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='pass',
+                first_name=name, last_name=name
+            )
+            for name in ('reader', 'other', 'author')
+        ]
+        cls.recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=cls.author, name=f'recipe{i}', text='text',
+                cooking_time=10, image='recipes/images/recipe.png'
+            )
+            for i in range(3)
+        )
+
+    def timeline(self, user):
+        return set(
+            TimelineEntry.objects.filter(user=user).values_list(
+                'recipe', flat=True
+            )
+        )
+
+    def test_rebuild_restores_lost_entries(self):
+        Subscription.objects.create(user=self.reader, author=self.author)
+        out = StringIO()
+        call_command('rebuild_timeline', user=[self.reader.pk], stdout=out)
+        self.assertEqual(
+            self.timeline(self.reader), {r.pk for r in self.recipes}
+        )
+        self.assertIn('Пересобрано лент: 1', out.getvalue())
+
+    @override_settings(FEED_FANOUT_MAX_FOLLOWERS=1)
+    def test_author_below_threshold_is_backfilled(self):
+        Subscription.objects.create(user=self.reader, author=self.author)
+        subscription = Subscription.objects.create(
+            user=self.other, author=self.author
+        )
+        subscription.delete()
+        # Задачи после коммита в TestCase не выполняются, вызываем сами
+        clear_timeline(self.other.pk, self.author.pk)
+        self.assertEqual(
+            self.timeline(self.reader), {r.pk for r in self.recipes}
+        )
+        self.assertEqual(self.timeline(self.other), set())
+
+
+class ThreadPoolBrokerTests(TestCase):
+    def test_full_queue_runs_task_in_place(self):
+        broker = ThreadPoolBroker(name='test', workers=1, queue_size=0)
+        started, release = threading.Event(), threading.Event()
+        threads = []
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        def record():
+            threads.append(threading.current_thread())
+
+        broker.enqueue(block)
+        started.wait(5)
+        with self.assertLogs('recipes.tasks', 'WARNING'):
+            broker.enqueue(record)
+        release.set()
+        broker.executor.shutdown()
+        self.assertEqual(threads, [threading.current_thread()])
+
+
+class DecayPopularityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='pass',
+            first_name='Author', last_name='Author'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=author, name='recipe', text='text', cooking_time=10,
+            image='recipes/images/recipe.png', popularity=8
+        )
+
+    def decay(self):
+        call_command('decay_popularity', stdout=StringIO())
+        self.recipe.refresh_from_db()
+        return self.recipe.popularity
+
+    @override_settings(POPULARITY_HALF_LIFE_HOURS=24)
+    def test_decays_by_time_since_last_run(self):
+        # Первый запуск только запоминает время
+        self.assertEqual(self.decay(), 8)
+        PopularityDecay.objects.update(
+            decayed_at=timezone.now() - timedelta(hours=48)
+        )
+        self.assertAlmostEqual(self.decay(), 2, places=3)
+
+
+@override_settings(
+    CACHES={
+        'state': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'tests-similar-state',
+        },
+    },
+    # Частых ингредиентов нет: в тесте их доля всегда велика
+    SIMILAR_COMMON_INGREDIENT_SHARE=1
+)
+class BuildSimilarRecipesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.first, cls.second = [
+            User.objects.create_user(
+                username=name, email=f'{name}@example.com', password='pass',
+                first_name=name, last_name=name
+            )
+            for name in ('author', 'first', 'second')
+        ]
+        cls.ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name=f'ingredient{i}', measurement_unit='г')
+            for i in range(4)
+        )
+        cls.soup, cls.stew, cls.salad = [
+            cls.create_recipe(name, ingredients)
+            for name, ingredients in (
+                ('soup', (0, 1)), ('stew', (1, 2)), ('salad', (3,))
+            )
+        ]
+        for user, recipes in (
+            (cls.first, (cls.soup, cls.stew)),
+            (cls.second, (cls.stew, cls.salad)),
+        ):
+            for recipe in recipes:
+                Favourite.objects.create(user=user, recipe=recipe)
+
+    @classmethod
+    def create_recipe(cls, name, ingredients):
+        recipe = Recipe.objects.create(
+            author=cls.author, name=name, text='text', cooking_time=10,
+            image='recipes/images/recipe.png'
+        )
+        IngredientAmount.objects.bulk_create(
+            IngredientAmount(
+                recipe=recipe, ingredient=cls.ingredients[i], amount=1
+            )
+            for i in ingredients
+        )
+        Recipe.objects.filter(pk=recipe.pk).update_search_index()
+        return recipe
+
+    def build(self, *args):
+        call_command('build_similar_recipes', *args, stdout=StringIO())
+        return {
+            (row.recipe_id, row.similar_id): round(row.score, 6)
+            for row in SimilarRecipe.objects.all()
+        }
+
+    def test_incremental_build_matches_full(self):
+        self.build('--full')
+        # Новый рецепт делит ингредиент с супом, а новое избранное
+        # меняет число добавлений салата, которое входит в оценку рагу
+        self.create_recipe('porridge', (0,))
+        reader = User.objects.create_user(
+            username='reader', email='reader@example.com', password='pass',
+            first_name='reader', last_name='reader'
+        )
+        Favourite.objects.create(user=reader, recipe=self.salad)
+        self.assertEqual(self.build(), self.build('--full'))
+
+
+class IngredientReaderTests(TestCase):
+    rows = [('соль', 'г'), ('молоко', 'мл')]
+
+    def test_csv(self):
+        self.assertEqual(
+            list(read_csv(StringIO('соль,г\n\nмолоко,мл\n'))), self.rows
+        )
+
+    def test_csv_short_row(self):
+        with self.assertRaisesMessage(CommandError, 'Строка 2'):
+            list(read_csv(StringIO('соль,г\nмолоко\n')))
+
+    def test_json(self):
+        data = (
+            '[{"name": "соль", "measurement_unit": "г"},\n'
+            ' {"name": "молоко", "measurement_unit": "мл"}]\n'
+        )
+        # Маленький буфер: объекты режутся границами чанков
+        for buffer_size in (7, 64 * 1024):
+            with self.subTest(buffer_size=buffer_size):
+                self.assertEqual(
+                    list(read_json(StringIO(data), buffer_size)), self.rows
+                )
+
+    def test_json_malformed(self):
+        valid = '[{"name": "соль", "measurement_unit": "г"}'
+        # Нераспознанный остаток; смещение в байтах, кириллица — по два
+        for rest in ('{"na', '', 'x, {}]'):
+            with self.subTest(rest=rest):
+                data = valid + (', ' + rest if rest else '')
+                offset = len(data.encode()) - len(rest.encode())
+                with self.assertRaisesMessage(CommandError, f'Байт {offset}'):
+                    list(read_json(StringIO(data), buffer_size=16))
+
+    def test_json_missing_fields(self):
+        with self.assertRaisesMessage(CommandError, 'measurement_unit'):
+            list(read_json(StringIO('[{"name": "соль"}]')))
@@ -1,12 +1,20 @@
 from django.contrib import admin
 
 from .models import Subscription, User
+from api.cache import RECIPES_TAG, forget_recipe_fragments, invalidate_tags
 from recipes.models import (Favourite, Ingredient, IngredientAmount, Recipe,
                             ShoppingCart, Tag)
 
 
 class UserAdmin(admin.ModelAdmin):
     list_filter = ('email', 'username')
+    readonly_fields = ('recipes_count', 'followers_count')
+
+
+class IngredientAmountInline(admin.TabularInline):
+    model = IngredientAmount
+    autocomplete_fields = ('ingredient',)
+    extra = 1
 
 
 class RecipeAdmin(admin.ModelAdmin):
@@ -16,6 +24,20 @@ class RecipeAdmin(admin.ModelAdmin):
         'favourites_count'
     )
     list_filter = ('author', 'name', 'tags')
+    readonly_fields = (
+        'favourites_count', 'in_cart_count', 'thumbnail', 'image_webp'
+    )
+    inlines = (IngredientAmountInline,)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        Recipe.objects.filter(
+            pk=form.instance.pk
+        ).update_search_index()
+        if change:
+            # У ингредиентов нет сигналов: кэш сбрасывается раз на рецепт
+            forget_recipe_fragments([form.instance.pk])
+            invalidate_tags(RECIPES_TAG)
 
 
 class IngredientAdmin(admin.ModelAdmin):
@@ -24,6 +46,7 @@ class IngredientAdmin(admin.ModelAdmin):
         'measurement_unit'
     )
     list_filter = ('name',)
+    search_fields = ('name',)
 
 
 admin.site.register(Subscription)
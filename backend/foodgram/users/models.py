@@ -26,6 +26,9 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=150)
     last_name = models.CharField(max_length=150)
     password = models.CharField(max_length=150)
+    # Счётчики обновляются сигналами (recipes/signals.py)
+    recipes_count = models.PositiveIntegerField(default=0)
+    followers_count = models.PositiveIntegerField(default=0)
 
 
 class Subscription(models.Model):
@@ -51,3 +54,9 @@ class Subscription(models.Model):
                 check=~models.Q(user=models.F("author")),
             ),
         ]
+        indexes = [
+            # Подписки пользователя от новых к старым (список подписок)
+            models.Index(
+                fields=['user', '-id'], name='subscription_user_latest'
+            ),
+        ]